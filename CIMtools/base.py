@@ -18,6 +18,10 @@
 #
 from CGRtools.containers import ReactionContainer
 from itertools import tee
+from numpy import (add, append, arange, asarray, concatenate, diff, flatnonzero, float64, hstack, lexsort, maximum,
+                   repeat, where, zeros)
+from pandas import DataFrame
+from scipy.sparse import coo_matrix, hstack as sparse_hstack, issparse
 from sklearn.base import BaseEstimator, TransformerMixin
 from .utils import iter2array
 
@@ -39,15 +43,34 @@ class CIMtoolsTransformerMixin(TransformerMixin, BaseEstimator):
             return iter2array(x, dtype=self._dtype)
         return iter2array(x)
 
+    def fit_transform(self, x, y=None, **fit_params):
+        if type(self).fit is CIMtoolsTransformerMixin.fit:  # stateless. validate data only once
+            return self.transform(x)
+        return super().fit_transform(x, y, **fit_params)
+
     _dtype = None
 
 
-def reaction_support(_class, module=None):
+def reaction_support(_class, module=None, unique_fit=False, aggregate=None, combine='concat'):
     """
     Class Factory for transformers without reactions support.
 
+    Molecules repeated in reactions are transformed only once.
+
     :param module: Current module name. required for pickle. By default _class module used.
+        Returned class should be stored in this module under its __qualname__: ReactionSupported{_class name} or,
+        if aggregate given, ReactionSupported{_class name}{Aggregate}{Combine}, e.g. ReactionSupportedFooSumDifference
+    :param unique_fit: fit on unique molecules only. By default fit on all molecules occurrences
+    :param aggregate: reduction of molecules vectors of each role (reactants, products, reagents): sum, mean or max.
+        By default transform returns list of (reactants, products, reagents) slices of transformed molecules
+    :param combine: combination of roles vectors: concat - concatenate reactants, products and reagents vectors,
+        difference - products vector minus reactants vector
     """
+    if aggregate not in (None, 'sum', 'mean', 'max'):
+        raise ValueError('invalid aggregate')
+    if combine not in ('concat', 'difference'):
+        raise ValueError('invalid combine')
+
     class ReactionSupported(_class):
         def fit(self, x, y=None, **fit_params):
             return self.__run(False, x, y=y, **fit_params)
@@ -82,17 +105,79 @@ def reaction_support(_class, module=None):
                 mols.extend(ms)
 
             if transform:
-                transformed = super().transform(mols)
-                if len(transformed) != len(mols):
+                unique, index = self.__unique(mols)
+                transformed = super().transform(unique)
+                if (transformed.shape[0] if hasattr(transformed, 'shape') else len(transformed)) != len(unique):
                     raise ValueError('unexpected transformed molecules amount')
+                if len(unique) != len(mols):  # scatter back to all occurrences
+                    transformed = self.__take(transformed, index)
+                if aggregate is not None:
+                    return self.__aggregate(transformed, r_shifts, p_shifts, g_shifts)
 
                 return [(r, p, g) for r, p, g in
                         zip((transformed[y: z] for y, z in self.__pairwise(r_shifts)),
                             (transformed[y: z] for y, z in self.__pairwise(p_shifts)),
                             (transformed[y: z] for y, z in self.__pairwise(g_shifts)))]
+            elif unique_fit:
+                return super().fit(self.__unique(mols)[0], **kwargs)
             else:
                 return super().fit(mols, **kwargs)
 
+        @staticmethod
+        def __aggregate(transformed, *shifts):
+            """
+            Reaction vectors from transformed molecules.
+            """
+            columns = None
+            if issparse(transformed):
+                reduce = _sparse_reduce
+                transformed = transformed.tocsr()
+            else:
+                reduce = _dense_reduce
+                if isinstance(transformed, DataFrame):
+                    columns = transformed.columns
+                transformed = asarray(transformed, dtype=float64)
+
+            r, p, g = (reduce(transformed, x, aggregate) for x in shifts)
+            if combine == 'difference':
+                out = p - r
+            elif issparse(r):
+                out = sparse_hstack((r, p, g), format='csr')
+            else:
+                out = hstack((r, p, g))
+
+            if columns is not None:
+                if combine != 'difference':
+                    columns = [f'{r}.{x}' for r in ('reactants', 'products', 'reagents') for x in columns]
+                return DataFrame(out, columns=columns)
+            return out
+
+        @staticmethod
+        def __unique(mols):
+            """
+            Unique molecules by canonical hash and index of each molecule in unique list.
+            """
+            keys = {}
+            unique = []
+            index = []
+            for m in mols:
+                k = bytes(m)
+                try:
+                    index.append(keys[k])
+                except KeyError:
+                    keys[k] = len(unique)
+                    index.append(len(unique))
+                    unique.append(m)
+            return unique, index
+
+        @staticmethod
+        def __take(transformed, index):
+            if isinstance(transformed, DataFrame):
+                return transformed.iloc[index].reset_index(drop=True)
+            elif isinstance(transformed, list):
+                return [transformed[x] for x in index]
+            return transformed[index]  # numpy arrays and scipy sparse matrices
+
         @staticmethod
         def __pairwise(iterable):
             """s -> (s0,s1), (s1,s2), (s2, s3), ..."""
@@ -100,9 +185,55 @@ def reaction_support(_class, module=None):
             next(b, None)
             return zip(a, b)
 
-    ReactionSupported.__qualname__ = f'ReactionSupported{_class.__name__}'
+    if aggregate is None:
+        ReactionSupported.__qualname__ = f'ReactionSupported{_class.__name__}'
+    else:  # different modes of same class should be distinguishable by pickle
+        ReactionSupported.__qualname__ = \
+            f'ReactionSupported{_class.__name__}{aggregate.capitalize()}{combine.capitalize()}'
     ReactionSupported.__module__ = module or _class.__module__
     return ReactionSupported
 
 
+def _dense_reduce(x, shifts, how):
+    """
+    Segments reduction of rows. Empty segments are zeros.
+
+    :param shifts: boundaries of consecutive segments
+    """
+    shifts = asarray(shifts)
+    sizes = diff(shifts)
+    out = zeros((len(sizes), x.shape[1]))
+    mask = sizes > 0
+    if mask.any():
+        ufunc = maximum if how == 'max' else add
+        out[mask] = ufunc.reduceat(x[shifts[0]:shifts[-1]], shifts[:-1][mask] - shifts[0], axis=0)
+        if how == 'mean':
+            out[mask] /= sizes[mask, None]
+    return out
+
+
+def _sparse_reduce(x, shifts, how):
+    """
+    Segments reduction of rows of sparse matrix. Empty segments are zeros.
+    """
+    shifts = asarray(shifts)
+    sizes = diff(shifts)
+    block = x[shifts[0]:shifts[-1]].tocoo()
+    rows = repeat(arange(len(sizes)), sizes)[block.row]
+    cols = block.col
+    data = block.data.astype(float64)
+
+    if how == 'max':
+        order = lexsort((cols, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        if len(data):
+            starts = flatnonzero(concatenate(([True], (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1]))))
+            counts = diff(append(starts, len(data)))
+            rows, cols, data = rows[starts], cols[starts], maximum.reduceat(data, starts)
+            data = where(counts < sizes[rows], maximum(data, 0), data)  # implicit zeros in segment
+    elif how == 'mean':
+        data /= sizes[rows]
+    return coo_matrix((data, (rows, cols)), shape=(len(sizes), x.shape[1])).tocsr()  # duplicates summed
+
+
 __all__ = ['CIMtoolsTransformerMixin', 'reaction_support']
@@ -21,4 +21,5 @@ from .molconvert_chemaxon import *
 from .nicklaus_tautomers import *
 from .reactions import *
 
-__all__ = ['molconvert_chemaxon', 'load_sn2', 'load_e2', 'load_da', 'load_nicklaus_tautomers']
+__all__ = ['molconvert_chemaxon', 'molconvert_chemaxon_iter', 'load_sn2', 'load_e2', 'load_da',
+           'load_nicklaus_tautomers']
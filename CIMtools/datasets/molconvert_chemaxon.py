@@ -17,11 +17,15 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from CGRtools import RDFRead
-from io import StringIO, BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO, BytesIO, TextIOWrapper
 from pathlib import Path
-from subprocess import run, PIPE
+from subprocess import run, Popen, PIPE
+from tempfile import TemporaryFile
+from threading import Thread
 from ..exceptions import ConfigurationError
-from ..utils import iter2array
+from ..utils import iter2array, effective_n_jobs
 
 
 def molconvert_chemaxon(data):
@@ -66,4 +70,150 @@ def molconvert_chemaxon(data):
         return iter2array(r)
 
 
-__all__ = ['molconvert_chemaxon']
+def molconvert_chemaxon_iter(data, *, n_jobs=None, chunk_size=1000, record_format=None):
+    """
+    Streaming ChemAxon molconvert wrapper.
+
+    Input read by lines and split on records boundaries into chunks. Chunks converted by several molconvert
+    processes at once. Output of each process parsed while it runs.
+
+    Parameters
+    ----------
+    data : Buffer or string or path to file
+        All supported by molconvert formats for chemical data storing.
+    n_jobs : int
+        Number of molconvert processes running at once.
+    chunk_size : int
+        Number of records converted by one molconvert process.
+    record_format : 'sdf', 'rdf', 'lines' or None
+        Input records layout. 'lines' means one record per line, e.g. SMILES. By default detected by file
+        extension or RDF header. Input of unknown layout converted in one chunk.
+
+    Yields
+    ------
+    Molecules or reactions in order of input.
+    """
+    n_jobs = effective_n_jobs(n_jobs)
+    if record_format is None:
+        if isinstance(data, Path):
+            record_format = _suffixes.get(data.suffix.lower())
+        elif isinstance(data, str) and data.startswith('$RDFILE') or \
+                isinstance(data, bytes) and data.startswith(b'$RDFILE'):
+            record_format = 'rdf'
+    elif record_format not in ('sdf', 'rdf', 'lines'):
+        raise ValueError("record_format should be 'sdf', 'rdf', 'lines' or None")
+
+    lines = _lines(data)
+    if record_format is None:  # check RDF header
+        first = next(lines, b'')
+        if first.startswith(b'$RDFILE'):
+            record_format = 'rdf'
+        lines = _chain(first, lines)
+
+    running = deque()
+    with ThreadPoolExecutor(n_jobs) as executor:
+        for chunk in _split(lines, chunk_size, record_format):
+            running.append(executor.submit(_convert, chunk))
+            if len(running) > n_jobs:  # keep all processes busy while current chunk consumed
+                yield from running.popleft().result()
+        while running:
+            yield from running.popleft().result()
+
+
+def _lines(data):
+    if isinstance(data, Path):
+        with data.open('rb') as f:
+            yield from f
+    elif isinstance(data, (str, bytes)):
+        yield from BytesIO(data.encode() if isinstance(data, str) else data)
+    elif hasattr(data, 'read'):
+        for line in data:
+            yield line.encode() if isinstance(line, str) else line
+    else:
+        raise ValueError('invalid input')
+
+
+def _chain(first, lines):
+    if first:
+        yield first
+    yield from lines
+
+
+def _split(lines, chunk_size, record_format):
+    """
+    Group lines into chunks of records.
+    """
+    if record_format is None:
+        yield b''.join(lines)
+        return
+
+    header = []
+    chunk = []
+    count = 0
+    for line in lines:
+        if record_format == 'rdf':
+            if line.startswith(_rdf_records):
+                if count == chunk_size:
+                    yield b''.join(header + chunk)
+                    chunk = []
+                    count = 0
+                count += 1
+            elif not count:  # RDF header repeated in each chunk
+                header.append(line)
+                continue
+            chunk.append(line)
+        elif record_format == 'sdf':
+            chunk.append(line)
+            if line.rstrip() == b'$$$$':
+                count += 1
+                if count == chunk_size:
+                    yield b''.join(chunk)
+                    chunk = []
+                    count = 0
+        elif line.strip():
+            chunk.append(line)
+            count += 1
+            if count == chunk_size:
+                yield b''.join(chunk)
+                chunk = []
+                count = 0
+    if any(x.strip() for x in chunk):
+        yield b''.join(header + chunk)
+
+
+def _convert(chunk):
+    with TemporaryFile() as stderr:
+        try:
+            p = Popen(['molconvert', '-g', 'rdf'], stdin=PIPE, stdout=PIPE, stderr=stderr)
+        except FileNotFoundError as e:
+            raise ConfigurationError from e
+
+        feeder = Thread(target=_feed, args=(p.stdin, chunk), daemon=True)
+        feeder.start()
+        with TextIOWrapper(p.stdout) as f, RDFRead(f) as r:
+            out = list(r)
+        feeder.join()
+        if p.wait() != 0:
+            stderr.seek(0)
+            raise ConfigurationError(stderr.read().decode())
+    return out
+
+
+def _feed(stdin, chunk):
+    try:
+        stdin.write(chunk)
+    except BrokenPipeError:  # molconvert failed
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+_suffixes = {'.sdf': 'sdf', '.sd': 'sdf', '.rdf': 'rdf', '.smi': 'lines', '.smiles': 'lines', '.cxsmi': 'lines',
+             '.smarts': 'lines', '.inchi': 'lines'}
+_rdf_records = (b'$RFMT', b'$MFMT', b'$RIREG', b'$REREG', b'$MIREG', b'$MEREG')
+
+
+__all__ = ['molconvert_chemaxon', 'molconvert_chemaxon_iter']
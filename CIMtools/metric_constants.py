@@ -65,6 +65,8 @@ pound = lb = 16 * oz
 
 
 class _Celsius:
+    __array_ufunc__ = None  # numpy arrays and pandas objects defer to __rmul__ and __rtruediv__
+
     def __rmul__(self, other):
         return 273.15 + other
 
@@ -73,6 +75,8 @@ class _Celsius:
 
 
 class _Fahrenheit:
+    __array_ufunc__ = None  # numpy arrays and pandas objects defer to __rmul__ and __rtruediv__
+
     def __rmul__(self, other):
         return 273.15 + (other - 32) / 1.8
 
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CIMtools.
+#
+#  CIMtools is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from numpy import ndarray
+from pandas import DataFrame, RangeIndex, Series
+from scipy.sparse import issparse
+from .utils import effective_n_jobs
+
+
+def iter_transform(estimator, data, chunk_size=1000, n_jobs=None, method='transform'):
+    """
+    Streaming transformation of data by fitted estimator or pipeline.
+
+    Data read and transformed by chunks, so memory usage is bounded by chunk size instead of data size.
+    Index of DataFrame and Series results continues numbering of previous chunks.
+
+    :param estimator: fitted transformer or pipeline
+    :param data: iterable of items. e.g. RDFRead reader, list, DataFrame or array
+    :param chunk_size: number of items in chunk
+    :param n_jobs: number of processes. chunks transformed in parallel keeping order
+    :param method: name of estimator method. e.g. transform or predict
+    :return: generator of transformed chunks
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size should be positive')
+    chunks = _chunks(data, chunk_size)
+    n_jobs = effective_n_jobs(n_jobs)
+    start = 0
+    if n_jobs == 1:
+        function = getattr(estimator, method)
+        for chunk in chunks:
+            yield _reindex(function(chunk), start)
+            start += len(chunk)
+        return
+
+    with ProcessPoolExecutor(n_jobs, initializer=_init_estimator, initargs=(estimator, method)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((len(chunk), executor.submit(_apply, chunk)))
+            if len(pending) > n_jobs:  # keep workers busy but limit number of chunks in memory
+                size, future = pending.popleft()
+                yield _reindex(future.result(), start)
+                start += size
+        while pending:
+            size, future = pending.popleft()
+            yield _reindex(future.result(), start)
+            start += size
+
+
+def dump_transform(estimator, data, file, chunk_size=1000, n_jobs=None, method='transform', **kwargs):
+    """
+    Streaming transformation of data into CSV file.
+
+    :param file: path or opened text file
+    :param kwargs: DataFrame.to_csv options
+    :return: number of written rows
+    """
+    header = kwargs.pop('header', True)
+    if not hasattr(file, 'write'):
+        with open(file, 'w', newline='') as f:
+            return dump_transform(estimator, data, f, chunk_size, n_jobs, method, header=header, **kwargs)
+
+    rows = 0
+    for x in iter_transform(estimator, data, chunk_size, n_jobs, method):
+        if issparse(x):
+            x = DataFrame(x.toarray(), index=RangeIndex(rows, rows + x.shape[0]))
+        elif isinstance(x, Series):
+            x = x.to_frame()
+        elif not isinstance(x, DataFrame):
+            x = DataFrame(x, index=RangeIndex(rows, rows + len(x)))
+        x.to_csv(file, header=header if not rows else False, **kwargs)
+        rows += len(x)
+    return rows
+
+
+def _chunks(data, size):
+    if isinstance(data, (DataFrame, Series)):
+        for i in range(0, len(data), size):
+            yield data.iloc[i: i + size]
+    elif isinstance(data, ndarray):
+        for i in range(0, len(data), size):
+            yield data[i: i + size]
+    else:
+        data = iter(data)
+        for chunk in iter(lambda: list(islice(data, size)), []):
+            yield chunk
+
+
+def _reindex(x, start):
+    if isinstance(x, (DataFrame, Series)):
+        x.index = RangeIndex(start, start + len(x))
+    return x
+
+
+def _init_estimator(estimator, method):
+    global _function
+    _function = getattr(estimator, method)
+
+
+def _apply(chunk):
+    return _function(chunk)
+
+
+__all__ = ['iter_transform', 'dump_transform']
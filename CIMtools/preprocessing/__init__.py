@@ -28,8 +28,8 @@ from .standardize import *
 from .standardize import __all__ as _standardize
 
 
-__all__ = ['Conditions', 'DictToConditions', 'ConditionsToDataFrame', 'SolventVectorizer', 'EquationTransformer',
-           'CGR', 'MoleculesToMatrix', 'CGRToMatrix']
+__all__ = ['Conditions', 'ConditionsBatch', 'DictToConditions', 'ConditionsToDataFrame', 'SolventVectorizer',
+           'EquationTransformer', 'CGR', 'MoleculesToMatrix', 'CGRToMatrix']
 __all__.extend(_standardize)
 
 if 'Fragmentor' in locals():
@@ -18,14 +18,23 @@
 #
 from CGRtools import CGRPreparer
 from CGRtools.containers import ReactionContainer
-from pandas import DataFrame
 from ..base import CIMtoolsTransformerMixin
 from ..exceptions import ConfigurationError
+from ..utils import chunked_map, effective_n_jobs, validated_frame
 
 
 class CGR(CIMtoolsTransformerMixin):
-    def __init__(self, cgr_type='0'):
+    def __init__(self, cgr_type='0', n_jobs=None, chunk_size=None):
+        """
+        Reactions to CGR transformer
+
+        :param cgr_type: CGRPreparer type
+        :param n_jobs: number of worker processes
+        :param chunk_size: number of reactions sent to worker at once. by default reactions evenly split
+        """
         self.cgr_type = cgr_type
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
         self.__init()
 
     def __init(self):
@@ -49,10 +58,29 @@ class CGR(CIMtoolsTransformerMixin):
 
     def transform(self, x):
         x = super().transform(x)
-        cgr = self.__cgr
-        return DataFrame([[cgr.compose(s)] for s in x], columns=['CGR'])
+        if effective_n_jobs(self.n_jobs) > 1:
+            cgrs = [c for chunk in chunked_map(_compose, x, self.n_jobs, self.chunk_size,
+                                               initializer=_init_preparer, initargs=(self.cgr_type,))
+                    for c in chunk]
+        else:
+            cgr = self.__cgr
+            cgrs = [cgr.compose(s) for s in x]
+        return validated_frame(cgrs, 'CGR', {type(cgrs[0])})  # cgr_type defines type of all results
 
     _dtype = ReactionContainer
+    n_jobs = chunk_size = None
+
+
+def _init_preparer(cgr_type):
+    global _preparer
+    _preparer = CGRPreparer(cgr_type)
+
+
+def _compose(reactions):
+    return [_preparer.compose(r) for r in reactions]
+
+
+_preparer = None
 
 
 __all__ = ['CGR']
@@ -21,20 +21,45 @@ try:
     from collections.abc import Mapping  # since python 3.10
 except ImportError:
     from collections import Mapping
-from functools import partial
+from functools import lru_cache, partial
 from itertools import chain
+from numbers import Integral
+from numpy import argsort, array, asarray, float64, full, int16, isnan, take_along_axis, where, zeros
 from operator import itemgetter
-from pandas import DataFrame
+from pandas import Categorical, DataFrame, factorize, notna
 from ..base import CIMtoolsTransformerMixin
-from ..metric_constants import C, bar
+from ..metric_constants import C, K, Pa, bar
+from ..utils import validated_frame
 
 
 class Conditions:
+    __slots__ = ('__temperature', '__pressure', '__solvents')
+
     def __init__(self, temperature=25 * C, pressure=1 * bar, solvents=None):
         self.temperature = temperature
         self.pressure = pressure
         self.solvents = solvents
 
+    def __getstate__(self):
+        return {'_Conditions__temperature': self.__temperature, '_Conditions__pressure': self.__pressure,
+                '_Conditions__solvents': self.__solvents}
+
+    def __setstate__(self, state):
+        self.__temperature = state['_Conditions__temperature']
+        self.__pressure = state['_Conditions__pressure']
+        self.__solvents = state['_Conditions__solvents']
+
+    @classmethod
+    def _from_valid(cls, temperature, pressure, solvents):
+        """
+        Create conditions from already validated values.
+        """
+        self = object.__new__(cls)
+        self.__temperature = temperature
+        self.__pressure = pressure
+        self.__solvents = solvents
+        return self
+
     @property
     def temperature(self):
         return self.__temperature
@@ -64,14 +89,8 @@ class Conditions:
     @solvents.setter
     def solvents(self, value):
         solvents = []
-        for k, v in value:
-            k = hyphens_replace(k)
-            k = single_quotes_replace(k)
-            k = k.replace("''", '"')  # double quotes from single
-            try:
-                k = known_solvents[k.lower()]
-            except KeyError:
-                raise KeyError(f'unknown solvent: {k}')
+        for k, v in value or ():
+            k = normalize_solvent(k)
             v = float(v)
             if v <= 0 or v > 1:
                 raise ValueError('impossible solvent amount')
@@ -81,16 +100,139 @@ class Conditions:
         self.__solvents = tuple(sorted(solvents, key=itemgetter(1), reverse=True))
 
 
+class FrozenConditions(Conditions):
+    """
+    Read-only conditions. Shared by equal rows of ConditionsBatch.
+    """
+    __slots__ = ()
+
+    temperature = property(Conditions.temperature.fget)
+    pressure = property(Conditions.pressure.fget)
+    solvents = property(Conditions.solvents.fget)
+
+
+class ConditionsBatch:
+    def __init__(self, temperature, pressure, solvents=None, amounts=None):
+        """
+        Columnar storage of conditions.
+
+        Solvents stored as integer codes of solvent_names sorted by amounts. Empty places coded as -1 with zero amount.
+
+        :param temperature: array of temperatures
+        :param pressure: array of pressures
+        :param solvents: 2d array of solvents names or codes. empty places marked by None or -1
+        :param amounts: 2d array of solvents amounts
+        """
+        temperature = asarray(temperature, dtype=float64)
+        pressure = asarray(pressure, dtype=float64)
+        if temperature.ndim != 1 or temperature.shape != pressure.shape:
+            raise ValueError('temperature and pressure should be 1d arrays of equal size')
+        if not (temperature > 0).all():
+            raise ValueError('only positive temperature possible in this universe')
+        if not (pressure > 0).all():
+            raise ValueError('only positive pressure possible in this universe')
+
+        if solvents is None:
+            solvents = zeros((len(temperature), 0), dtype=int16)
+            amounts = zeros((len(temperature), 0))
+        else:
+            solvents = asarray(solvents)
+            amounts = asarray(amounts, dtype=float64)
+            if solvents.ndim != 2 or solvents.shape != amounts.shape or len(solvents) != len(temperature):
+                raise ValueError('solvents and amounts should be 2d arrays of equal shape')
+            if solvents.dtype.kind not in 'iu':
+                codes, names = factorize(solvents.ravel())  # None and nan coded as -1
+                table = array([solvent_codes[normalize_solvent(x)] for x in names] + [-1], dtype=int16)
+                solvents = table[codes].reshape(solvents.shape)
+            elif ((solvents < -1) | (solvents >= len(solvent_names))).any():
+                raise ValueError('invalid solvent codes')
+            else:
+                solvents = solvents.astype(int16)
+
+            empty = solvents == -1
+            if not ((amounts > 0) & (amounts <= 1) | empty).all():
+                raise ValueError('impossible solvent amount')
+            amounts = where(empty, 0., amounts)
+            if (amounts.sum(axis=1) > 1).any():
+                raise ValueError('impossible total amount of solvents')
+
+            order = argsort(-amounts, axis=1, kind='stable')
+            solvents = take_along_axis(solvents, order, axis=1)
+            amounts = take_along_axis(amounts, order, axis=1)
+
+        self.temperature = temperature
+        self.pressure = pressure
+        self.solvents = solvents
+        self.amounts = amounts
+        self.__interned = {}
+
+    @classmethod
+    def _from_valid(cls, temperature, pressure, solvents, amounts):
+        self = object.__new__(cls)
+        self.temperature = temperature
+        self.pressure = pressure
+        self.solvents = solvents
+        self.amounts = amounts
+        self.__interned = {}
+        return self
+
+    @classmethod
+    def from_conditions(cls, conditions):
+        """
+        Pack sequence of Conditions.
+        """
+        conditions = list(conditions)
+        size = max((len(c.solvents) for c in conditions), default=0)
+        solvents = full((len(conditions), size), -1, dtype=int16)
+        amounts = zeros((len(conditions), size))
+        for n, c in enumerate(conditions):
+            for m, (k, v) in enumerate(c.solvents):
+                solvents[n, m] = solvent_codes[k]
+                amounts[n, m] = v
+        return cls._from_valid(array([c.temperature for c in conditions], dtype=float64),
+                               array([c.pressure for c in conditions], dtype=float64), solvents, amounts)
+
+    def __len__(self):
+        return len(self.temperature)
+
+    def __iter__(self):
+        return (self[n] for n in range(len(self)))
+
+    def __getitem__(self, item):
+        """
+        Conditions of row by integer index. Equal rows share same read-only Conditions object.
+        Batch of selected rows by slice or array index.
+        """
+        if isinstance(item, Integral):
+            t = self.temperature[item]
+            p = self.pressure[item]
+            s = self.solvents[item]
+            a = self.amounts[item]
+            key = (t, p, s.tobytes(), a.tobytes())
+            try:
+                return self.__interned[key]
+            except KeyError:
+                c = FrozenConditions._from_valid(float(t), float(p),
+                                                 tuple((solvent_names[k], float(v)) for k, v in zip(s, a) if k != -1))
+                self.__interned[key] = c
+                return c
+        return self._from_valid(self.temperature[item], self.pressure[item], self.solvents[item], self.amounts[item])
+
+
 class DictToConditions(CIMtoolsTransformerMixin):
     def __init__(self, temperature=None, pressure=None, solvents=None, amounts=None,
                  default_temperature=25 * C, default_pressure=1 * bar,
-                 default_first_solvent='water', default_first_amount=1):
-        """Dictionary to Conditions mapper
-
-        :param temperature: name of temperature key
-        :param pressure: name of pressure key
-        :param solvents: names of solvents keys
-        :param amounts: names of solvents amounts keys
+                 default_first_solvent='water', default_first_amount=1, batch=False,
+                 temperature_unit=K, pressure_unit=Pa):
+        """Dictionary or DataFrame to Conditions mapper
+
+        :param temperature: name of temperature key or column
+        :param pressure: name of pressure key or column
+        :param solvents: names of solvents keys or columns
+        :param amounts: names of solvents amounts keys or columns
+        :param batch: return ConditionsBatch instead of DataFrame of Conditions
+        :param temperature_unit: unit of temperature values from metric_constants. e.g. C
+        :param pressure_unit: unit of pressure values from metric_constants. e.g. bar
         """
         if solvents:
             if 1 < len(solvents) != len(amounts):
@@ -106,47 +248,81 @@ class DictToConditions(CIMtoolsTransformerMixin):
         self.default_pressure = default_pressure
         self.default_first_solvent = default_first_solvent
         self.default_first_amount = default_first_amount
+        self.batch = batch
+        self.temperature_unit = temperature_unit
+        self.pressure_unit = pressure_unit
+
+    def fit(self, x, y=None):
+        if not self.__is_table(x):
+            super().fit(x)
+        elif not len(x):
+            raise ValueError('empty input array')
+        return self
 
     def transform(self, x):
-        x = super().transform(x)
+        """
+        Convert records to conditions.
+
+        :param x: sequence of mappings or DataFrame (or Arrow Table) with records in rows.
+            Missing keys and NA values replaced by defaults. In multi-solvent mode NA solvents are skipped,
+            but solvent and amount should be both NA or both given
+        """
+        if self.__is_table(x):
+            if hasattr(x, 'to_pandas'):  # Arrow Table
+                x = x.to_pandas()
+            if not len(x):
+                raise ValueError('empty input array')
+        else:
+            x = DataFrame(list(super().transform(x)))  # records to columns
 
         if self.solvents:
             if len(self.solvents) > 1:
-                solvents = self.solvents
-                solvents = [[d[k] for k in solvents] for d in x]
-                amounts = self.amounts
-                amounts = [[d[k] for k in amounts] for d in x]
+                solvents = x[list(self.solvents)].to_numpy(dtype=object)
+                amounts = x[list(self.amounts)].to_numpy(dtype=float64)
+                if (notna(solvents) == isnan(amounts)).any():
+                    raise ValueError('solvent without amount or amount without solvent')
             else:
-                solvents = self.solvents[0]
-                solvents = [[d.get(solvents, self.default_first_solvent)] for d in x]
-                if self.amounts:
-                    amounts = self.amounts[0]
-                    amounts = [[d.get(amounts, self.default_first_amount)] for d in x]
-                else:
-                    amounts = [[self.default_first_amount]] * len(x)
+                solvents = self.__column(x, self.solvents[0], self.default_first_solvent, object)[:, None]
+                amounts = self.__column(x, self.amounts and self.amounts[0], self.default_first_amount)[:, None]
         elif self.amounts:
-            amounts = self.amounts[0]
-            amounts = [[d.get(amounts, self.default_first_amount)] for d in x]
-            solvents = [[self.default_first_solvent]] * len(x)
+            amounts = self.__column(x, self.amounts[0], self.default_first_amount)[:, None]
+            solvents = full(amounts.shape, self.default_first_solvent, dtype=object)
         else:
-            solvents = amounts = [[]] * len(x)
+            solvents = amounts = zeros((len(x), 0))
 
-        if self.temperature:
-            temperatures = self.temperature
-            temperatures = [d.get(temperatures, self.default_temperature) for d in x]
-        else:
-            temperatures = [self.default_temperature] * len(x)
+        temperatures = self.__column(x, self.temperature, self.default_temperature, unit=self.temperature_unit)
+        pressures = self.__column(x, self.pressure, self.default_pressure, unit=self.pressure_unit)
 
-        if self.pressure:
-            pressures = self.pressure
-            pressures = [d.get(pressures, self.default_pressure) for d in x]
-        else:
-            pressures = [self.default_pressure] * len(x)
+        if self.batch:
+            if not solvents.size:
+                return ConditionsBatch(temperatures, pressures)
+            return ConditionsBatch(temperatures, pressures, solvents, amounts)
+        return validated_frame([Conditions(t, p, [(k, v) for k, v in zip(s, a) if notna(k)])
+                                for t, p, s, a in zip(temperatures, pressures, solvents, amounts)], 'conditions',
+                               (Conditions,))
 
-        return DataFrame([[Conditions(t, p, zip(*s))]
-                          for t, p, s in zip(temperatures, pressures, zip(solvents, amounts))], columns=['conditions'])
+    @staticmethod
+    def __is_table(x):
+        return isinstance(x, DataFrame) or hasattr(x, 'to_pandas') and hasattr(x, 'column_names')
+
+    @staticmethod
+    def __column(x, key, default, dtype=float64, unit=None):
+        """
+        Column of values with NA replaced by default. Units applied to whole column.
+        """
+        if not key or key not in x:
+            return full(len(x), default, dtype=dtype)
+        column = x[key]
+        if dtype is float64:
+            column = column.astype(float64)
+            if unit is not None:
+                column = column * unit
+        return column.fillna(default).to_numpy(dtype=dtype)
 
     _dtype = Mapping
+    batch = False
+    temperature_unit = K
+    pressure_unit = Pa
 
 
 class ConditionsToDataFrame(CIMtoolsTransformerMixin):
@@ -165,6 +341,23 @@ class ConditionsToDataFrame(CIMtoolsTransformerMixin):
                [f'solvent_amount.{x}' for x in range(1, self.max_solvents + 1)]
 
     def transform(self, x):
+        if isinstance(x, ConditionsBatch):
+            if not len(x):
+                raise ValueError('empty input array')
+            size = self.max_solvents
+            solvents = full((len(x), size), -1, dtype=int16)
+            amounts = full((len(x), size), float('nan'))
+            solvents[:, :x.solvents.shape[1]] = x.solvents[:, :size]
+            amounts[:, :x.amounts.shape[1]] = x.amounts[:, :size]
+            amounts[solvents == -1] = float('nan')
+            names = self.get_feature_names()
+            data = {'temperature': x.temperature, 'pressure': x.pressure}
+            for n in range(size):
+                data[names[2 + n]] = Categorical.from_codes(solvents[:, n], categories=solvent_names)
+            for n in range(size):
+                data[names[2 + size + n]] = amounts[:, n]
+            return DataFrame(data)
+
         x = super().transform(x)
         res = []
         for c in x:
@@ -278,6 +471,50 @@ known_solvents = (
 )
 
 
+def normalize_solvent(name):
+    """
+    Canonical name of solvent. Results including unknown names are memoized.
+    """
+    k, suggestions = _lookup_solvent(name)
+    if suggestions is None:
+        return k
+    elif suggestions:
+        raise KeyError(f'unknown solvent: {k}. did you mean: {", ".join(suggestions)}?')
+    raise KeyError(f'unknown solvent: {k}')
+
+
+@lru_cache(maxsize=10000)
+def _lookup_solvent(name):
+    """
+    Canonical name of solvent and None or normalized unknown name and list of similar known names.
+    """
+    k = name.translate(_normalize_table).lower()
+    if "''" in k:
+        k = k.replace("''", '"')  # double quotes from single
+    try:
+        return known_solvents[k], None
+    except KeyError:
+        return k, _suggest_solvents(k)
+
+
+def _ngrams(name):
+    name = f'  {name} '
+    return {name[i: i + 3] for i in range(len(name) - 2)}
+
+
+def _suggest_solvents(name, n=3, cutoff=.5):
+    """
+    Known names similar to given. Dice similarity of trigrams used. Only names sharing trigrams are scored.
+    """
+    grams = _ngrams(name)
+    common = {}
+    for g in grams:
+        for k in _ngrams_index.get(g, ()):
+            common[k] = common.get(k, 0) + 1
+    scores = sorted(((2 * c / (len(grams) + _ngrams_count[k]), k) for k, c in common.items()), reverse=True)
+    return [k for x, k in scores[:n] if x >= cutoff]
+
+
 def multi_replace(string: str, patterns, replacement: str):
     for p in patterns:
         string = string.replace(p, replacement)
@@ -286,6 +523,7 @@ def multi_replace(string: str, patterns, replacement: str):
 
 single_quotes_replace = partial(multi_replace, patterns=('‘', '’'), replacement="'")
 hyphens_replace = partial(multi_replace, patterns=('‐', '‑', '‒', '–', '—', '―', '₋', '−'), replacement='-')
+_normalize_table = str.maketrans({**dict.fromkeys('‐‑‒–—―₋−', '-'), **dict.fromkeys('‘’', "'")})
 
 
 tmp = {}
@@ -299,6 +537,16 @@ for n, s, *o in known_solvents:
         tmp[x.lower()] = n
 
 known_solvents = tmp
+solvent_names = tuple(solvent_smiles)
+solvent_codes = {n: i for i, n in enumerate(solvent_names)}
+
+_ngrams_index = {}
+_ngrams_count = {}
+for x in known_solvents:
+    _ngrams_count[x] = len(_ngrams(x))
+    for y in _ngrams(x):
+        _ngrams_index.setdefault(y, []).append(x)
 
 
-__all__ = ['Conditions', 'DictToConditions', 'ConditionsToDataFrame', 'known_solvents', 'solvent_smiles']
+__all__ = ['Conditions', 'ConditionsBatch', 'DictToConditions', 'ConditionsToDataFrame', 'known_solvents',
+           'solvent_smiles', 'solvent_names']
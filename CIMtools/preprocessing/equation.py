@@ -16,17 +16,30 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
+from functools import lru_cache
+from collections.abc import Mapping
 from numbers import Number
-from math import sin, cos, tan, log, log10, e, pi
-from operator import add, sub, mul, truediv, pow
+from numpy import (absolute, add, asarray, broadcast_shapes, broadcast_to, cos, e, empty, errstate, float64, log,
+                   log10, multiply, negative, pi, power, rint, shape, sign, sin, subtract, tan, true_divide, trunc,
+                   where)
 from pandas import DataFrame
 from pyparsing import Literal, CaselessLiteral, Word, Combine, Optional, ZeroOrMore, Forward, nums, alphas
 from ..base import CIMtoolsTransformerMixin
 
 
 class EquationTransformer(CIMtoolsTransformerMixin):
-    def __init__(self, equation='x'):
+    def __init__(self, equation='x', variables=None):
+        """
+        Features calculated by equations.
+
+        Equations can use named variables bound to input columns. For 1-d input or single column DataFrame
+        the only variable is x. For DataFrame variables are column names.
+
+        :param equation: equation or list of equations
+        :param variables: names of input columns. required for 2-d arrays. for DataFrame overrides column names
+        """
         self.equation = equation
+        self.variables = variables
 
     def get_feature_names(self):
         """Get feature names.
@@ -36,22 +49,96 @@ class EquationTransformer(CIMtoolsTransformerMixin):
         feature_names : list of strings
             Names of the features produced by transform.
         """
-        return [f'equation={self.equation}']
+        return [f'equation={x}' for x in self.__equations]
+
+    def fit(self, x, y=None):
+        self.__variables(x)
+        return self
 
     def transform(self, x):
-        x = super().transform(x)
-        f = Eval(self.equation)
-        return DataFrame([[f(x)] for x in x], columns=self.get_feature_names())
+        variables = self.__variables(x)
+        size = len(next(iter(variables.values())))
+        out = empty((size, len(self.__equations)))
+        for n, eq in enumerate(self.__equations):
+            out[:, n] = Eval(eq)(variables)
+        return DataFrame(out, columns=self.get_feature_names())
+
+    @property
+    def __equations(self):
+        if isinstance(self.equation, str):
+            return [self.equation]
+        return list(self.equation)
+
+    def __variables(self, x):
+        """
+        Mapping of variables names to input columns.
+        """
+        if self.variables is not None:
+            x = x.values if isinstance(x, DataFrame) else asarray(x)
+            if x.ndim == 1:
+                x = x.reshape(-1, 1)
+            if x.ndim != 2 or x.shape[1] != len(self.variables):
+                raise ValueError('invalid data shape')
+            if not len(x):
+                raise ValueError('empty input array')
+            return {n: x[:, i] for i, n in enumerate(self.variables)}
+        elif isinstance(x, DataFrame) and x.shape[1] > 1:
+            if not len(x):
+                raise ValueError('empty input array')
+            return {n: x[n] for n in x.columns}
+        elif isinstance(x, DataFrame):
+            if not len(x):
+                raise ValueError('empty input array')
+            return {x.columns[0]: x.iloc[:, 0], 'x': x.iloc[:, 0]}
+        return {'x': super().transform(x)}
 
     _dtype = Number
+    variables = None
 
 
 class Eval:
     def __init__(self, expression):
-        self.__expr_stack = self.__parser(expression)
+        self.__function, self.variables = self.__compile(expression)
 
     def __call__(self, value):
-        return self.__evaluate_stack([value if x == 'X' else x for x in self.__expr_stack])
+        """
+        Evaluate expression for number or for all elements of array.
+
+        :param value: number or array bound to x or mapping of variables names to numbers or arrays.
+            result has shape of broadcasted values
+        :raise FloatingPointError: invalid operation, division by zero or overflow
+        """
+        if isinstance(value, Mapping):
+            variables = {}
+            for k in self.variables:
+                if k not in value:
+                    raise KeyError(f'unknown variable: {k}')
+                variables[k] = asarray(value[k], dtype=float64)
+            size = broadcast_shapes(*(shape(v) for v in value.values()))
+        else:
+            for k in self.variables:
+                if k != 'x':
+                    raise KeyError(f'unknown variable: {k}')
+            variables = {'x': asarray(value, dtype=float64)}
+            size = variables['x'].shape
+
+        with errstate(divide='raise', over='raise', invalid='raise'):
+            out = self.__function(variables)
+        if not size:
+            return float(out)
+        return broadcast_to(out, size).copy()  # constant expressions return scalar
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def __compile(expression):
+        """
+        Compile expression into vectorized function of variables mapping.
+
+        :return: function and tuple of variables names
+        """
+        stack = Eval.__parser(expression)
+        variables = tuple(dict.fromkeys(x[1] for x in stack if isinstance(x, tuple)))
+        return Eval.__build(stack), variables
 
     @staticmethod
     def __parser(expression):
@@ -62,6 +149,13 @@ class Eval:
         def push_first(strg, loc, toks):
             expr_stack.append(toks[0])
 
+        def push_variable(strg, loc, toks):
+            name = toks[0].upper()
+            if name in ('PI', 'E'):
+                expr_stack.append(name)
+            else:  # x is case insensitive
+                expr_stack.append(('var', 'x' if name == 'X' else toks[0]))
+
         def push_u_minus(strg, loc, toks):
             if toks and toks[0] == '-':
                 expr_stack.append('unary -')
@@ -71,7 +165,7 @@ class Eval:
         fnumber = Combine(Word('+-' + nums, nums) +
                           Optional(point + Optional(Word(nums))) +
                           Optional(_e + Word('+-' + nums, nums)))
-        ident = Word(alphas, alphas + nums + '_$')
+        ident = Word(alphas, alphas + nums + '_$.')
 
         plus = Literal("+")
         minus = Literal("-")
@@ -82,11 +176,11 @@ class Eval:
         addop = plus | minus
         multop = mult | div
         expop = Literal("^")
-        _pi = CaselessLiteral("PI")
-        x = CaselessLiteral("X")
 
         expr = Forward()
-        atom = (Optional("-") + (x | _pi | _e | fnumber | ident + lpar + expr + rpar).setParseAction(push_first) |
+        function = (ident + lpar + expr + rpar).setParseAction(push_first)
+        variable = ident.copy().setParseAction(push_variable)  # including x, pi and e
+        atom = (Optional("-") + (fnumber.copy().setParseAction(push_first) | function | variable) |
                 (lpar + expr.suppress() + rpar)).setParseAction(push_u_minus)
 
         factor = Forward()
@@ -99,29 +193,34 @@ class Eval:
         return expr_stack
 
     @classmethod
-    def __evaluate_stack(cls, s):
+    def __build(cls, s):
         op = s.pop()
-        if isinstance(op, str):
-            if op == 'unary -':
-                return -cls.__evaluate_stack(s)
-            elif op in '+-*/^':
-                op2 = cls.__evaluate_stack(s)
-                op1 = cls.__evaluate_stack(s)
-                return cls.__opn[op](op1, op2)
-            elif op in cls.__fn:
-                return cls.__fn[op](cls.__evaluate_stack(s))
-            elif op == 'PI':
-                return pi
-            elif op == 'E':
-                return e
-            else:
-                return float(op)
+        if op == 'unary -':
+            f = cls.__build(s)
+            return lambda x: negative(f(x))
+        elif op in cls.__opn:
+            f2 = cls.__build(s)
+            f1 = cls.__build(s)
+            o = cls.__opn[op]
+            return lambda x: o(f1(x), f2(x))
+        elif op in cls.__fn:
+            f = cls.__build(s)
+            o = cls.__fn[op]
+            return lambda x: o(f(x))
+        elif isinstance(op, tuple):
+            name = op[1]
+            return lambda x: x[name]
+        elif op == 'PI':
+            c = pi
+        elif op == 'E':
+            c = e
         else:
-            return op
+            c = float(op)
+        return lambda x: c
 
-    __opn = {'+': add, '-': sub, '*': mul, '/': truediv, '^': pow}
-    __fn = {'sin': sin, 'cos': cos, 'tan': tan, 'lg': log10, 'ln': log, 'abs': abs, 'trunc': lambda a: int(a),
-            'round': round, 'sgn': lambda a: (1 if a > 0 else -1) if abs(a) > 1e-12 else 0}
+    __opn = {'+': add, '-': subtract, '*': multiply, '/': true_divide, '^': power}
+    __fn = {'sin': sin, 'cos': cos, 'tan': tan, 'lg': log10, 'ln': log, 'abs': absolute, 'trunc': trunc,
+            'round': rint, 'sgn': lambda a: where(absolute(a) > 1e-12, sign(a), 0.)}
 
 
 __all__ = ['EquationTransformer']
@@ -17,30 +17,157 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
+from CGRtools import smiles
+from hashlib import sha256
 from importlib.util import find_spec
+from multiprocessing import get_all_start_methods
+from numpy import asarray, concatenate, empty, flatnonzero, pad
+from os import cpu_count
 from os.path import dirname, join
+from queue import Full, Queue
 from sys import modules
+from threading import Event, Thread
+from threadpoolctl import threadpool_limits
+from warnings import warn
+from .cache import EmbeddingCache
 from ..graph_to_matrix import MoleculesToMatrix
 from ...base import CIMtoolsTransformerMixin
+from ...utils import chunked_map, effective_n_jobs
 
 
 class GNNFingerprint(CIMtoolsTransformerMixin):
-    def __init__(self):
+    def __init__(self, batch_size=None, max_atoms=None, engine=None, cache=None, cache_size=1000000, n_jobs=None,
+                 intra_op_threads=None, inter_op_threads=None):
         """
         Molecules encoder
+
+        :param batch_size: number of molecules encoded at once. molecules grouped into batches by size.
+            by default all molecules encoded in one batch padded to the largest molecule
+        :param max_atoms: maximal number of atoms in padded batch. used only with batch_size
+        :param engine: 'tensorflow' or 'numpy' inference. by default tensorflow used if installed
+        :param cache: path to directory of persistent embeddings cache. only not cached molecules will be encoded
+        :param cache_size: maximal number of cached embeddings. the least recently used are evicted
+        :param n_jobs: number of worker processes. with numpy engine workers are forked after model loading and
+            share its weights. tensorflow is not fork-safe, thus each spawned worker loads own model
+        :param intra_op_threads: threads used by single operation. for tensorflow applied only before runtime
+            initialization, i.e. before first encoding or preload call in process. for numpy limits BLAS threads.
+            with n_jobs by default cpu count evenly split between workers
+        :param inter_op_threads: threads running independent operations in parallel. used only by tensorflow.
+            with n_jobs by default 1
         """
+        self.batch_size = batch_size
+        self.max_atoms = max_atoms
+        self.engine = engine
+        self.cache = cache
+        self.cache_size = cache_size
+        self.n_jobs = n_jobs
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
         self.__m2m = MoleculesToMatrix(is_radical=True)
 
     def __getstate__(self):
-        return {'_GNNFingerprint__m2m': self.__m2m}
+        return {'batch_size': self.batch_size, 'max_atoms': self.max_atoms, 'engine': self.engine,
+                'cache': self.cache, 'cache_size': self.cache_size, 'n_jobs': self.n_jobs,
+                'intra_op_threads': self.intra_op_threads, 'inter_op_threads': self.inter_op_threads,
+                '_GNNFingerprint__m2m': self.__m2m}
+
+    def preload(self, warmup=True):
+        """
+        Load encoder in current process. Call before forking of workers to share loaded model.
+
+        :param warmup: encode dummy molecule to trigger lazy initialization of model
+        """
+        encoder = self.__load(self.engine, self.intra_op_threads, self.inter_op_threads)
+        if warmup:
+            with threadpool_limits(self.intra_op_threads):
+                encoder(_pad(self.__m2m.transform([smiles('CC(=O)O')]).data))
+        return self
 
     def transform(self, x):
-        x = self.__m2m.transform(x).data
-        x = self.__encoder(x).numpy()
-        return x
+        if not self.cache:
+            return self.__encode(x)
+
+        x = list(super().transform(x))
+        cache = self.__open_cache()
+        keys = [cache.key(m) for m in x]
+        out, found = cache.get(keys)
+        missing = {}
+        for i in flatnonzero(~found):
+            missing.setdefault(keys[i], []).append(i)
+        if missing:
+            embeddings = self.__encode([x[i[0]] for i in missing.values()])
+            for e, i in zip(embeddings, missing.values()):
+                out[i] = e
+            cache.put(list(missing), embeddings)
+        return out
+
+    def __open_cache(self):
+        cache = self.__caches.get(self.cache)
+        if cache is None or cache.capacity != self.cache_size:
+            with open(join(dirname(modules[__package__].__file__), 'weights.h5'), 'rb') as f:
+                weights = sha256(f.read()).digest()
+            self.__caches[self.cache] = cache = EmbeddingCache(self.cache, self.cache_size, namespace=weights)
+        return cache
+
+    def __encode(self, x):
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs > 1:
+            return self.__parallel_encode(x, n_jobs)
+
+        encoder = self.__load(self.engine, self.intra_op_threads, self.inter_op_threads)
+        with threadpool_limits(self.intra_op_threads):
+            if not self.batch_size:
+                x = self.__m2m.transform(x).data
+                return asarray(encoder(_pad(x)))
+
+            x = super().transform(x)
+            out = None
+            for i, m in _prefetch(self.__m2m.transform_batches(x, self.batch_size, self.max_atoms)):
+                m = asarray(encoder(_pad(m.data)))
+                if out is None:
+                    out = empty((len(x), m.shape[1]), dtype=m.dtype)
+                out[i] = m
+            return out
+
+    def __parallel_encode(self, x, n_jobs):
+        x = super().transform(x)
+        n_jobs = min(n_jobs, len(x))
+        worker = GNNFingerprint(batch_size=self.batch_size, max_atoms=self.max_atoms, engine=self.engine,
+                                intra_op_threads=self.intra_op_threads or max(cpu_count() // n_jobs, 1),
+                                inter_op_threads=self.inter_op_threads or 1)
+        if self.__engine(self.engine) == 'numpy' and 'fork' in get_all_start_methods():
+            self.__load('numpy')  # forked workers inherit loaded weights
+            context = 'fork'
+        else:
+            context = 'spawn'
+        return concatenate(chunked_map(worker.transform, x, n_jobs, initializer=worker.preload, initargs=(False,),
+                                       mp_context=context))
+
+    @staticmethod
+    def __engine(engine):
+        if engine is None:
+            return 'tensorflow' if find_spec('tensorflow') else 'numpy'
+        elif engine not in ('tensorflow', 'numpy'):
+            raise ValueError("engine should be 'tensorflow' or 'numpy'")
+        return engine
 
-    def __new__(cls, *args, **kwargs):
-        if cls.__encoder is None:  # load only once
+    @classmethod
+    def __load(cls, engine, intra_op_threads=None, inter_op_threads=None):
+        engine = cls.__engine(engine)
+        if engine == 'tensorflow' and (intra_op_threads or inter_op_threads):
+            cls.__set_threads(intra_op_threads, inter_op_threads)
+
+        try:
+            return cls.__encoders[engine]  # load only once
+        except KeyError:
+            pass
+
+        path = join(dirname(modules[__package__].__file__), 'weights.h5')
+        if engine == 'numpy':
+            from .numpy_gnn import NumpyGNN
+
+            encoder = NumpyGNN(path)
+        else:
             import tensorflow as tf
             import tensorflow.keras.backend as K
             from tensorflow.keras.layers import Input, Dense
@@ -59,16 +186,86 @@ class GNNFingerprint(CIMtoolsTransformerMixin):
             m = Dense(50, activation=lambda x: K.l2_normalize(x, axis=-1), kernel_initializer='truncated_normal')(m)
 
             encoder = Model(inputs=[atoms, connections_m], outputs=m)
-            path = join(dirname(modules[__package__].__file__), 'weights.h5')
             encoder.load_weights(path)
-            cls.__encoder = encoder
+        cls.__encoders[engine] = encoder
+        return encoder
+
+    @staticmethod
+    def __set_threads(intra_op_threads, inter_op_threads):
+        from tensorflow.config import threading
+
+        for value, get, set_ in ((intra_op_threads, threading.get_intra_op_parallelism_threads,
+                                  threading.set_intra_op_parallelism_threads),
+                                 (inter_op_threads, threading.get_inter_op_parallelism_threads,
+                                  threading.set_inter_op_parallelism_threads)):
+            if value and get() != value:
+                try:
+                    set_(value)
+                except RuntimeError:  # tensorflow runtime already initialized
+                    warn('tensorflow threads can be configured only before runtime initialization. '
+                         'settings ignored', RuntimeWarning)
+
+    __encoders = {}
+    __caches = {}
+    batch_size = max_atoms = engine = cache = n_jobs = intra_op_threads = inter_op_threads = None
+    cache_size = 1000000
+
+
+def _pad(x, size=4):
+    """
+    Pad matrices up to top_k atoms of GraphConv layers.
+    """
+    atoms, bonds = x
+    if atoms.shape[1] >= size:
+        return x
+    size -= atoms.shape[1]
+    return pad(atoms, ((0, 0), (0, size), (0, 0))), pad(bonds, ((0, 0), (0, size), (0, size)))
+
+
+def _prefetch(iterable, size=2):
+    """
+    Iterate in background thread. Next batches matrices are prepared while the current batch is encoded.
+
+    Thread stopped if consumer stops iteration early.
+    """
+    queue = Queue(size)
+    stop = Event()
+    done = object()
 
-        return super().__new__(cls)
+    def put(x):
+        while not stop.is_set():
+            try:
+                queue.put(x, timeout=.1)
+            except Full:
+                continue
+            return True
+        return False
 
-    __encoder = None
+    def worker():
+        try:
+            for x in iterable:
+                if not put(x):
+                    return
+        except Exception as e:
+            put(e)
+        else:
+            put(done)
 
+    thread = Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            x = queue.get()
+            if x is done:
+                return
+            elif isinstance(x, Exception):
+                raise x
+            yield x
+    finally:
+        stop.set()
+        thread.join()
 
-if find_spec('tensorflow'):
+if find_spec('tensorflow') or find_spec('h5py'):
     __all__ = ['GNNFingerprint']
 else:
     del GNNFingerprint
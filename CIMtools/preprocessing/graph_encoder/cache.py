@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CIMtools.
+#
+#  CIMtools is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from hashlib import sha256
+from numpy import array, float32, zeros
+from numpy.lib.format import open_memmap
+from pathlib import Path
+from time import time_ns
+from ...utils import SQLiteLRU
+
+
+class EmbeddingCache(SQLiteLRU):
+    def __init__(self, path, capacity=1000000, size=50, namespace=b''):
+        """
+        Persistent LRU cache of molecules embeddings.
+
+        Embeddings stored in memory-mapped npy file. Keys and last usage time stored in sqlite index.
+        Cache can be shared between processes.
+
+        :param path: cache directory
+        :param capacity: maximal number of stored embeddings
+        :param size: embedding size
+        :param namespace: bytes mixed into keys. e.g. hash of model weights
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        super().__init__(path / 'index.sqlite', 'slot INTEGER NOT NULL')
+        self.capacity = capacity
+        self.size = size
+        self.namespace = namespace
+
+        file = path / 'embeddings.npy'
+        if file.exists():
+            data = open_memmap(str(file), mode='r+')
+            if data.shape != (capacity, size):
+                raise ValueError(f'cache created with different capacity or size: {data.shape}')
+        else:
+            data = open_memmap(str(file), mode='w+', dtype=float32, shape=(capacity, size))
+        self.__data = data
+
+    def key(self, molecule):
+        """
+        Key of molecule. Canonical structure hash mixed with namespace.
+        """
+        return sha256(self.namespace + bytes(molecule)).digest()
+
+    def get(self, keys):
+        """
+        Get cached embeddings.
+
+        :return: embeddings array and mask of found keys. embeddings of not found keys are zeros
+        """
+        out = zeros((len(keys), self.size), dtype=float32)
+        found = zeros(len(keys), dtype=bool)
+        with self._transaction() as db:
+            slots = self._select(db, keys, 'slot')
+            if slots:  # copy before commit. slots of found keys can't be reused by writers meanwhile
+                index = [n for n, k in enumerate(keys) if k in slots]
+                found[index] = True
+                out[index] = self.__data[[slots[keys[n]] for n in index]]
+        return out, found
+
+    def put(self, keys, embeddings):
+        """
+        Store embeddings. The least recently used embeddings evicted if cache is full.
+
+        Slots of new embeddings are reserved by placeholder rows before writing, so keys never point to partially
+        written or reused slots. Placeholders of crashed writers are evicted after reservation timeout.
+        """
+        new = dict(zip(keys, embeddings))
+        with self._transaction(lock=True) as db:
+            for k in self._stored(db, keys):
+                new.pop(k, None)  # stored by other process
+            new = list(new.items())[-self.capacity:]
+            if not new:
+                return
+            count, = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+            slots = list(range(count, min(count + len(new), self.capacity)))
+            if len(slots) < len(new):  # occupied slots are always 0..count-1. reuse slots of evicted rows
+                evicted = db.execute('SELECT key, slot FROM cache WHERE length(key) != 9 OR used < ? '
+                                     'ORDER BY used LIMIT ?',
+                                     (time_ns() - self._reservation * 10 ** 9, len(new) - len(slots))).fetchall()
+                db.executemany('DELETE FROM cache WHERE key = ?', ((k,) for k, _ in evicted))
+                slots.extend(s for _, s in evicted)
+                new = new[:len(slots)]  # other writers reserved rest of slots
+                if not new:
+                    return
+            used = time_ns()
+            db.executemany('INSERT INTO cache (key, slot, used) VALUES (?, ?, ?)',
+                           ((self.__placeholder(s), s, used) for s in slots))
+
+        self.__data[slots] = array([v for _, v in new], dtype=float32)
+        self.__data.flush()
+
+        with self._transaction(lock=True) as db:
+            stored = self._stored(db, [k for k, _ in new])  # by other process meanwhile
+            used = time_ns()
+            db.executemany('UPDATE cache SET key = ?, used = ? WHERE key = ?',
+                           ((k, used, self.__placeholder(s)) for (k, _), s in zip(new, slots) if k not in stored))
+            # slots of duplicates stay reserved till eviction
+            db.executemany('UPDATE cache SET used = 0 WHERE key = ?',
+                           ((self.__placeholder(s),) for (k, _), s in zip(new, slots) if k in stored))
+
+    @staticmethod
+    def __placeholder(slot):
+        """
+        Key of reserved slot. Shorter than any real key.
+        """
+        return b'\0' + slot.to_bytes(8, 'big')
+
+    _reservation = 600  # seconds
+
+__all__ = ['EmbeddingCache']
@@ -97,15 +97,23 @@ def connections_m_pad_k(k):
 def mask_pad_by_adj():
     def _mask_pad_by_adj(x):
         adj_m_pad, x = x
-        n = K.sum(K.sum(adj_m_pad, axis=-1), axis=0)
+        n = K.sum(adj_m_pad, axis=-1)  # mask of each molecule. padding of other molecules in batch ignored
         n = tf.math.divide_no_nan(n, n)
-        n = K.expand_dims(n, axis=0)
         n = K.expand_dims(n, axis=-1)
         return x * n
 
     return Lambda(_mask_pad_by_adj)
 
 
+def mask_pad_by_atoms():
+    def _mask_pad_by_atoms(x):
+        nodes, x = x
+        n = K.cast(K.not_equal(nodes[..., :1], 0), x.dtype)  # padding atoms have zero atomic number
+        return x * n
+
+    return Lambda(_mask_pad_by_atoms)
+
+
 class Atom_Emb(Layer):
     def __init__(self, nodes_num, emb_size):
         super(Atom_Emb, self).__init__()
@@ -197,6 +205,7 @@ def GNN(nodes_num, connections_num, selector_size, top_k, depth):
     concat_vectors = Dense(300, kernel_initializer='he_normal')(vectors)
     concat_vectors = BatchNormalization()(concat_vectors)
     concat_vectors = FTSwish()(concat_vectors)
+    concat_vectors = mask_pad_by_atoms()([nodes, concat_vectors])
 
     mols = RMS()(concat_vectors)
 
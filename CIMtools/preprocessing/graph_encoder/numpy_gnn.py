@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2020 Daniyar Mazitov <daniyarttt@gmail.com>
+#  Copyright 2020 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CIMtools.
+#
+#  CIMtools is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from h5py import File
+from numpy import asarray, concatenate, exp, float32, intp, maximum, partition, sort, sqrt, zeros
+
+
+class NumpyGNN:
+    def __init__(self, path, top_k=4, depth=2, epsilon=1e-3):
+        """
+        TensorFlow free inference of GNN encoder.
+
+        Same architecture as gnn.GNN with Dense head. Batch normalization layers are folded into preceding
+        Dense and Conv1D layers.
+
+        :param path: path to keras h5 weights file
+        :param epsilon: batch normalization epsilon
+        """
+        self.top_k = top_k
+        self.depth = depth
+
+        weights = {}
+        with File(path, 'r') as f:
+            for layer in f.attrs['layer_names']:
+                group = f[layer]
+                for name in group.attrs['weight_names']:
+                    name = name.decode() if isinstance(name, bytes) else name
+                    layer_name, param = name.rsplit('/', 1)
+                    weights.setdefault(layer_name.split('/')[-1], {})[param.split(':')[0]] = \
+                        asarray(group[name], dtype=float32)
+
+        # layers in order of creation
+        embeddings = [v['embeddings'] for k, v in weights.items() if k.startswith('embedding')]
+        dense = [v for k, v in weights.items() if k.startswith('dense')]
+        convs = [v for k, v in weights.items() if k.startswith('time_distributed')]
+        norms = [v for k, v in weights.items() if k.startswith('batch_normalization')]
+        if len(embeddings) != 2 or len(dense) != depth + 2 or len(convs) != 2 * depth or len(norms) != 4 * depth + 1:
+            raise ValueError('unexpected weights file structure')
+
+        def fold(layer, norm):
+            scale = norm['gamma'] / sqrt(norm['moving_variance'] + epsilon)
+            return layer['kernel'] * scale, (layer['bias'] - norm['moving_mean']) * scale + norm['beta']
+
+        self.__atoms_embedding, self.__bonds_embedding = embeddings
+        self.__layers = []
+        for i in range(depth):
+            selector, conv1, conv2 = dense[i], convs[2 * i], convs[2 * i + 1]
+            self.__layers.append((fold(selector, norms[4 * i]), fold(selector, norms[4 * i + 1]),
+                                  fold(conv1, norms[4 * i + 2]), fold(conv2, norms[4 * i + 3])))
+        self.__dense = fold(dense[-2], norms[-1])
+        self.__head = dense[-1]['kernel'], dense[-1]['bias']
+
+    def __call__(self, x):
+        """
+        Encode padded atoms and adjacency matrices. Same input as for keras model.
+        """
+        atoms, bonds = x
+        atoms = asarray(atoms)
+        bonds = asarray(bonds)
+        if atoms.shape[1] < self.top_k:
+            size = self.top_k - atoms.shape[1]
+            atoms = concatenate((atoms, zeros((atoms.shape[0], size, atoms.shape[2]), dtype=atoms.dtype)), axis=1)
+            bonds = concatenate((bonds, zeros((bonds.shape[0], size, bonds.shape[2]), dtype=bonds.dtype)), axis=1)
+            bonds = concatenate((bonds, zeros((bonds.shape[0], bonds.shape[1], size), dtype=bonds.dtype)), axis=2)
+
+        numbers = atoms[..., 0].astype(intp)
+        adj = (bonds != 0).astype(float32)
+        nodes = concatenate((atoms[..., 1:2].astype(float32), self.__atoms_embedding[numbers],
+                             atoms[..., 2:3].astype(float32)), axis=-1)
+        connections = self.__bonds_embedding[bonds.astype(intp)]
+
+        vectors = self.__graph_conv(adj, nodes, connections, *self.__layers[0])
+        for layer in self.__layers[1:]:
+            tmp = self.__graph_conv(adj, concatenate((nodes, vectors), axis=-1), connections, *layer)
+            vectors = concatenate((vectors, tmp), axis=-1)
+
+        x = _ft_swish(vectors @ self.__dense[0] + self.__dense[1])
+        x *= (numbers != 0)[..., None]  # mask padding atoms
+
+        size = (x.sum(axis=-1) != 0).sum(axis=-1, keepdims=True, dtype=float32)
+        x = sqrt((x ** 2).sum(axis=1) / size)  # RMS pooling
+
+        x = x @ self.__head[0] + self.__head[1]
+        return x / sqrt(maximum((x ** 2).sum(axis=-1, keepdims=True), 1e-12))
+
+    def __graph_conv(self, adj, atoms, connections, selector, ext_selector, conv1, conv2):
+        k = self.top_k
+        mask = adj[..., None]
+
+        # neighbors features: x[b, j, i] = [atoms[b, i] if i bonded to j, embedding of bond j-i]
+        x = concatenate((mask * atoms[:, None], connections), axis=-1)
+        x = _p_relu(x @ selector[0] + selector[1]) * mask
+        x = partition(x, x.shape[2] - k, axis=2)[:, :, -k:]
+        x = -sort(-x, axis=2)  # top k neighbors of each feature in descending order
+
+        ext = _p_relu(atoms @ ext_selector[0][:atoms.shape[-1]] + ext_selector[1])  # connections part is zero
+        x = concatenate((ext[:, :, None], x), axis=2)
+
+        x = _ft_swish(_conv1d(x, *conv1))
+        x = _ft_swish(_conv1d(x, *conv2))[:, :, 0]
+        return x * (adj.sum(axis=-1) != 0)[..., None]
+
+
+def _conv1d(x, kernel, bias):
+    """
+    Valid 1D convolution over the third axis.
+    """
+    size = x.shape[2] - kernel.shape[0] + 1
+    out = x[:, :, :size] @ kernel[0]
+    for t in range(1, kernel.shape[0]):
+        out += x[:, :, t: t + size] @ kernel[t]
+    return out + bias
+
+
+def _p_relu(x):
+    return maximum(x, 0) + 0.001
+
+
+def _ft_swish(x, threshold=-0.2):
+    x = maximum(x, 0)
+    return x / (1 + exp(-x)) + threshold
+
+
+__all__ = ['NumpyGNN']
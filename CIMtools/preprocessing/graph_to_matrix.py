@@ -17,60 +17,312 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from CGRtools import CGRContainer, MoleculeContainer
-from collections.abc import Sequence
-from numpy import zeros
+from collections.abc import Iterator, Sequence
+from functools import partial
+from itertools import islice
+from numbers import Integral
+from numpy import (arange, argsort, array, asarray, bool_, concatenate, cumsum, empty, flatnonzero, full, iinfo,
+                   int8, int16, int32, int64, integer, load, maximum, repeat, save, where, zeros)
+from pathlib import Path
 from ..base import CIMtoolsTransformerMixin
+from ..utils import chunked_map, effective_n_jobs
 
 
 class SlicedTuple(Sequence):
-    def __init__(self, data):
-        self.data = data
+    def __init__(self, data, index=None):
+        """
+        Arrays indexed together by the first axis.
+
+        :param data: tuple of arrays of equal length. memory-mapped arrays acceptable
+        :param index: positions of selected rows. rows gathered only on data access,
+            thus subsets of shared or memory-mapped arrays don't copy them
+        """
+        self.__data = data
+        self.__index = index
+
+    @property
+    def data(self):
+        if self.__index is None:
+            return self.__data
+        return tuple(x[self.__index] for x in self.__data)
+
+    @property
+    def shape(self):
+        return len(self),
+
+    @property
+    def shapes(self):
+        """
+        Shapes of arrays.
+        """
+        return tuple((len(self),) + x.shape[1:] for x in self.__data)
+
+    @property
+    def dtypes(self):
+        return tuple(x.dtype for x in self.__data)
 
     def __getitem__(self, i):
+        if isinstance(i, tuple) and len(i) == 2 and i[1] is Ellipsis:  # sklearn indexing
+            i = i[0]
         if isinstance(i, slice):
-            return SlicedTuple(tuple(x[i] for x in self.data))
+            if self.__index is None:
+                return SlicedTuple(tuple(x[i] for x in self.__data))
+            return SlicedTuple(self.__data, self.__index[i])
+        elif isinstance(i, (Integral, integer)):
+            if self.__index is not None:
+                i = self.__index[i]
+            return tuple(x[i] for x in self.__data)
+
+        i = asarray(i)
+        if i.dtype == bool_:
+            if i.shape != (len(self),):
+                raise IndexError('boolean index did not match')
+            i = flatnonzero(i)
+        elif not len(i):
+            i = i.astype(int64)
+        elif i.ndim != 1 or i.dtype.kind not in 'iu':
+            raise IndexError('only integers, slices, integer or boolean arrays are valid indices')
+        elif i.min() < -len(self) or i.max() >= len(self):
+            raise IndexError('index out of range')
         else:
-            return tuple(x[i] for x in self.data)
+            i = where(i < 0, i + len(self), i)
+
+        if self.__index is not None:
+            i = self.__index[i]
+        return SlicedTuple(self.__data, i)
 
     def __len__(self):
-        return len(self.data[0])
+        if self.__index is None:
+            return len(self.__data[0])
+        return len(self.__index)
 
     def __repr__(self):
         return repr(self.data)
 
+    def save(self, path):
+        """
+        Save arrays as npy files into given directory.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for n, x in enumerate(self.data):
+            save(path / f'{n}.npy', x)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load arrays saved by save method. By default arrays are memory-mapped in read-only mode.
+        """
+        path = Path(path)
+        data = []
+        while (path / f'{len(data)}.npy').exists():
+            data.append(load(path / f'{len(data)}.npy', mmap_mode=mmap_mode))
+        if not data:
+            raise FileNotFoundError(f'arrays not found in {path}')
+        return cls(tuple(data))
+
+
+class RaggedGraphs(Sequence):
+    def __init__(self, atoms, offsets, edges, bonds, edge_offsets):
+        """
+        Graphs matrices without padding.
+
+        :param atoms: concatenated atoms vectors of all graphs
+        :param offsets: atoms of i-th graph are atoms[offsets[i]: offsets[i + 1]]
+        :param edges: concatenated pairs of bonded atoms. atoms indices are local for each graph
+        :param bonds: bonds of edges
+        :param edge_offsets: edges and bonds of i-th graph are edges[edge_offsets[i]: edge_offsets[i + 1]]
+        """
+        self.atoms = atoms
+        self.offsets = offsets
+        self.edges = edges
+        self.bonds = bonds
+        self.edge_offsets = edge_offsets
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise IndexError('only contiguous slices supported')
+            stop = max(start, stop) + 1
+            return RaggedGraphs(self.atoms, self.offsets[start: stop], self.edges, self.bonds,
+                                self.edge_offsets[start: stop])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('graph index out of range')
+        a, b = self.offsets[i], self.offsets[i + 1]
+        c, d = self.edge_offsets[i], self.edge_offsets[i + 1]
+        return self.atoms[a: b], self.edges[c: d], self.bonds[c: d]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} graphs, {self.offsets[-1] - self.offsets[0]} atoms)'
+
+    @property
+    def sizes(self):
+        """
+        Atoms count of each graph.
+        """
+        return self.offsets[1:] - self.offsets[:-1]
+
 
 class GraphToMatrix(CIMtoolsTransformerMixin):
     def transform(self, x):
         x = super().transform(x)
-        size = max(len(g) for g in x)
-        atoms = zeros((len(x), size, self._atom_vector_size), dtype=int)
+        if self.ragged:
+            return self.__ragged(x)
+        return self.__padded(x)
+
+    def transform_batches(self, x, batch_size=64, max_atoms=None, buffer_size=None):
+        """
+        Transform graphs by batches of similar size.
+
+        Graphs sorted by atoms count and split into batches, thus padding is minimal and
+        memory is bounded by batch shape instead of the largest graph in the whole data.
+
+        :param batch_size: maximal number of graphs in batch
+        :param max_atoms: maximal number of atoms in padded batch (graphs count * size of the largest graph).
+            batch always contains at least one graph
+        :param buffer_size: number of graphs sorted together. by default all graphs. iterators consumed lazily
+        :return: generator of (indices, matrices) pairs. indices are positions of batch graphs in x
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size should be positive')
+        if not isinstance(x, Iterator):
+            x = super().transform(x)
+        x = iter(x)
+
+        shift = 0
+        while True:
+            buffer = list(islice(x, buffer_size)) if buffer_size else list(x)
+            if not buffer:
+                break
+            buffer = super().transform(buffer)
+
+            sizes = array([len(g) for g in buffer])
+            order = argsort(sizes, kind='stable')
+            start = 0
+            while start < len(order):
+                stop = min(start + batch_size, len(order))
+                if max_atoms:  # sizes sorted, thus the last graph is the largest
+                    while stop - start > 1 and (stop - start) * sizes[order[stop - 1]] > max_atoms:
+                        stop -= 1
+                batch = order[start: stop]
+                graphs = [buffer[i] for i in batch]
+                yield batch + shift, self.__ragged(graphs) if self.ragged else self.__padded(graphs)
+                start = stop
+
+            shift += len(buffer)
+            if not buffer_size:
+                break
+
+    def __padded(self, x):
+        atoms_, sizes, src, dst, bonds_, counts = self.__extract(x, not self.adjacent)
+        size = sizes.max()
+        offsets = zeros(len(sizes), dtype=int64)
+        cumsum(sizes[:-1], out=offsets[1:])
+
+        graph = repeat(arange(len(sizes)), sizes)
+        atoms = zeros((len(sizes), size, self._atom_vector_size), dtype=atoms_.dtype)
+        atoms[graph, arange(len(graph)) - offsets[graph]] = atoms_
+
+        graph = repeat(arange(len(sizes)), counts)
         if self.adjacent:
-            bonds = zeros((len(x), size, size), dtype=int)
-        else:
-            ngb = max(len(b) for g in x for b in g._bonds.values())
-            bonds = zeros((len(x), size, ngb), dtype=int)
-            connections = zeros((len(x), size, ngb), dtype=int) - 1
-
-        for i, g in enumerate(x):
-            aam = {}
-            for j, (n, a) in enumerate(g.atoms()):
-                aam[n] = j
-                atoms[i, j, :] = self._atom_vector(a)
-            if self.adjacent:
-                for n, m, b in g.bonds():
-                    bonds[i, aam[n], aam[m]] = bonds[i, aam[m], aam[n]] = int(b)
-            else:
+            bonds = zeros((len(sizes), size, size), dtype=bonds_.dtype)
+            bonds[graph, src, dst] = bonds_
+            bonds[graph, dst, src] = bonds_
+            return SlicedTuple((atoms, bonds))
+
+        # directed edges are grouped by source atom. slot is the order of edge in the group
+        slot = arange(len(src))
+        if len(slot):
+            key = offsets[graph] + src
+            slot -= maximum.accumulate(where(concatenate(([True], key[1:] != key[:-1])), slot, 0))
+        ngb = slot.max() + 1 if len(slot) else 0
+        bonds = zeros((len(sizes), size, ngb), dtype=bonds_.dtype)
+        connections = full((len(sizes), size, ngb), -1, dtype=_index_dtype(size))
+        bonds[graph, src, slot] = bonds_
+        connections[graph, src, slot] = dst
+        return SlicedTuple((atoms, bonds, connections))
+
+    def __ragged(self, x):
+        atoms, sizes, src, dst, bonds, counts = self.__extract(x, False)
+        offsets = zeros(len(sizes) + 1, dtype=int64)
+        edge_offsets = zeros(len(sizes) + 1, dtype=int64)
+        cumsum(sizes, out=offsets[1:])
+        cumsum(counts, out=edge_offsets[1:])
+
+        edges = empty((len(src), 2), dtype=_index_dtype(sizes.max()))
+        edges[:, 0] = src
+        edges[:, 1] = dst
+        return RaggedGraphs(atoms, offsets, edges, bonds, edge_offsets)
+
+    def __extract(self, x, directed):
+        if effective_n_jobs(self.n_jobs) == 1:
+            return self._graphs_arrays(x, directed)
+        parts = chunked_map(partial(self._graphs_arrays, directed=directed), x, self.n_jobs)
+        return tuple(concatenate(x) for x in zip(*parts))
+
+    def _graphs_arrays(self, x, directed=False):
+        """
+        Atoms vectors, sizes, bonded atoms local indices, bonds and bonds counts of graphs.
+        """
+        columns = [[] for _ in range(self._atom_vector_size)]
+        sizes = []
+        counts = []
+        src = []
+        dst = []
+        bonds = []
+        for g in x:
+            for c, v in zip(columns, self._atom_columns(g)):
+                c.extend(v)
+            sizes.append(len(g))
+
+            aam = {n: j for j, n in enumerate(g._atoms)}
+            tmp = len(bonds)
+            if directed:
                 for n, mb in g._bonds.items():
                     n = aam[n]
-                    for j, (m, b) in enumerate(mb.items()):
-                        bonds[i, n, j] = int(b)
-                        connections[i, n, j] = aam[m]
-        return SlicedTuple((atoms, bonds)) if self.adjacent else SlicedTuple((atoms, bonds, connections))
+                    for m, b in mb.items():
+                        src.append(n)
+                        dst.append(aam[m])
+                        bonds.append(int(b))
+            else:
+                for n, m, b in g.bonds():
+                    src.append(aam[n])
+                    dst.append(aam[m])
+                    bonds.append(int(b))
+            counts.append(len(bonds) - tmp)
+
+        atoms = empty((len(columns[0]), len(columns)), dtype=self._atom_dtype)
+        for i, c in enumerate(columns):
+            atoms[:, i] = c
+        return (atoms, array(sizes, dtype=int64), array(src, dtype=int32), array(dst, dtype=int32),
+                array(bonds, dtype=self._bond_dtype), array(counts, dtype=int64))
+
+    @property
+    def _atom_dtype(self):
+        return int16 if self.isotope else int8
+
+    _bond_dtype = int8
+    n_jobs = None
+    ragged = False
 
 
 class MoleculesToMatrix(GraphToMatrix):
     def __init__(self, charge=True, is_radical=False, isotope=False, hybridization=False, neighbors=False,
-                 implicit_hydrogens=False, total_hydrogens=False, in_ring=False, adjacent=True):
+                 implicit_hydrogens=False, total_hydrogens=False, in_ring=False, adjacent=True, ragged=False,
+                 n_jobs=None):
+        """
+        Molecules to atoms and bonds matrices
+
+        :param adjacent: return bonds as adjacency matrices. otherwise neighbors bonds and connections matrices
+        :param ragged: return RaggedGraphs without padding instead of padded matrices. adjacent ignored
+        :param n_jobs: number of processes used for matrices building
+        """
         self.charge = charge
         self.is_radical = is_radical
         self.isotope = isotope
@@ -80,26 +332,29 @@ class MoleculesToMatrix(GraphToMatrix):
         self.total_hydrogens = total_hydrogens
         self.in_ring = in_ring
         self.adjacent = adjacent
+        self.ragged = ragged
+        self.n_jobs = n_jobs
 
-    def _atom_vector(self, atom):
-        vector = [atom.atomic_number]
+    def _atom_columns(self, g):
+        atoms = g._atoms
+        columns = [[a.atomic_number for a in atoms.values()]]
         if self.charge:
-            vector.append(atom.charge)
+            columns.append(list(map(g._charges.__getitem__, atoms)))
         if self.is_radical:
-            vector.append(int(atom.is_radical))
+            columns.append(list(map(g._radicals.__getitem__, atoms)))
         if self.isotope:
-            vector.append(atom.isotope or 0)
+            columns.append([a.isotope or 0 for a in atoms.values()])
         if self.hybridization:
-            vector.append(atom.hybridization)
+            columns.append(list(map(g._hybridizations.__getitem__, atoms)))
         if self.neighbors:
-            vector.append(atom.neighbors)
+            columns.append(list(map(g.neighbors, atoms)))
         if self.implicit_hydrogens:
-            vector.append(atom.implicit_hydrogens)
+            columns.append(list(map(g._hydrogens.__getitem__, atoms)))
         if self.total_hydrogens:
-            vector.append(atom.total_hydrogens)
+            columns.append([a.total_hydrogens for a in atoms.values()])
         if self.in_ring:
-            vector.append(int(atom.in_ring))
-        return vector
+            columns.append([a.in_ring for a in atoms.values()])
+        return columns
 
     @property
     def _atom_vector_size(self):
@@ -127,7 +382,14 @@ class MoleculesToMatrix(GraphToMatrix):
 
 class CGRToMatrix(GraphToMatrix):
     def __init__(self, charge=True, is_radical=False, isotope=False, hybridization=False, neighbors=False,
-                 in_ring=False, adjacent=True):
+                 in_ring=False, adjacent=True, ragged=False, n_jobs=None):
+        """
+        CGRs to atoms and bonds matrices
+
+        :param adjacent: return bonds as adjacency matrices. otherwise neighbors bonds and connections matrices
+        :param ragged: return RaggedGraphs without padding instead of padded matrices. adjacent ignored
+        :param n_jobs: number of processes used for matrices building
+        """
         self.charge = charge
         self.is_radical = is_radical
         self.isotope = isotope
@@ -135,26 +397,29 @@ class CGRToMatrix(GraphToMatrix):
         self.neighbors = neighbors
         self.in_ring = in_ring
         self.adjacent = adjacent
+        self.ragged = ragged
+        self.n_jobs = n_jobs
 
-    def _atom_vector(self, atom):
-        vector = [atom.atomic_number]
+    def _atom_columns(self, g):
+        atoms = g._atoms
+        columns = [[a.atomic_number for a in atoms.values()]]
         if self.charge:
-            vector.append(atom.charge)
-            vector.append(atom.p_charge)
+            columns.append(list(map(g._charges.__getitem__, atoms)))
+            columns.append(list(map(g._p_charges.__getitem__, atoms)))
         if self.is_radical:
-            vector.append(int(atom.is_radical))
-            vector.append(int(atom.p_is_radical))
+            columns.append(list(map(g._radicals.__getitem__, atoms)))
+            columns.append(list(map(g._p_radicals.__getitem__, atoms)))
         if self.isotope:
-            vector.append(atom.isotope or 0)
+            columns.append([a.isotope or 0 for a in atoms.values()])
         if self.hybridization:
-            vector.append(atom.hybridization)
-            vector.append(atom.p_hybridization)
+            columns.append(list(map(g._hybridizations.__getitem__, atoms)))
+            columns.append(list(map(g._p_hybridizations.__getitem__, atoms)))
         if self.neighbors:
-            vector.append(atom.neighbors)
-            vector.append(atom.p_neighbors)
+            columns.append([a.neighbors for a in atoms.values()])
+            columns.append([a.p_neighbors for a in atoms.values()])
         if self.in_ring:
-            vector.append(int(atom.in_ring))
-        return vector
+            columns.append([a.in_ring for a in atoms.values()])
+        return columns
 
     @property
     def _atom_vector_size(self):
@@ -173,7 +438,18 @@ class CGRToMatrix(GraphToMatrix):
             size += 1
         return size
 
+    _bond_dtype = int64  # dynamic bonds are encoded by hash
     _dtype = CGRContainer
 
 
-__all__ = ['MoleculesToMatrix', 'CGRToMatrix']
+def _index_dtype(size):
+    """
+    The smallest integer dtype for atoms indices of graphs of given size.
+    """
+    for dtype in (int8, int16, int32):
+        if size <= iinfo(dtype).max:
+            return dtype
+    return int64
+
+
+__all__ = ['MoleculesToMatrix', 'CGRToMatrix', 'RaggedGraphs', 'SlicedTuple']
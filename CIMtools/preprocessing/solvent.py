@@ -16,8 +16,9 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from itertools import compress
-from pandas import DataFrame
+from numpy import add, array, isnan, zeros
+from pandas import DataFrame, Series
+from .conditions_container import Conditions, ConditionsBatch, hyphens_replace, solvent_codes
 from ..base import CIMtoolsTransformerMixin
 from ..exceptions import ConfigurationError
 
@@ -26,7 +27,13 @@ class SolventVectorizer(CIMtoolsTransformerMixin):
     def __init__(self, polarizability_form1=True, polarizability_form2=True, permettivity_form1=True,
                  permettivity_form2=True, permettivity_form3=True, permettivity_form4=True,
                  permettivity_polarizability=True, alpha_kamlet_taft=True, beta_kamlet_taft=True, pi_kamlet_taft=True,
-                 spp_katalan=True, sb_katalan=True, sa_katalan=True):
+                 spp_katalan=True, sb_katalan=True, sa_katalan=True, mixture=False):
+        """
+        Solvents descriptors
+
+        :param mixture: transform Conditions into amount-weighted descriptors of solvents mixtures
+            instead of solvents names into descriptors
+        """
         self.polarizability_form1 = polarizability_form1
         self.polarizability_form2 = polarizability_form2
         self.permettivity_form1 = permettivity_form1
@@ -40,6 +47,7 @@ class SolventVectorizer(CIMtoolsTransformerMixin):
         self.spp_katalan = spp_katalan
         self.sb_katalan = sb_katalan
         self.sa_katalan = sa_katalan
+        self.mixture = mixture
         self.__prepare_header()
 
     def __getstate__(self):
@@ -130,7 +138,7 @@ class SolventVectorizer(CIMtoolsTransformerMixin):
         if not header:
             raise ConfigurationError('required at least one parameter')
         self.__header = header
-        self.__index = index
+        self.__table = _descriptors[:, array(index, dtype=bool)]
 
     def get_feature_names(self):
         """Get feature names.
@@ -143,10 +151,45 @@ class SolventVectorizer(CIMtoolsTransformerMixin):
         return self.__header
 
     def transform(self, x):
+        if self.mixture:
+            return self.__mixture(x)
+
         x = super().transform(x)
-        return DataFrame([compress(described_solvents[x], self.__index) for x in x], columns=self.__header)
+        rows = Series(x, dtype=object).map(_index).values
+        if isnan(rows).any():
+            raise KeyError(f'unknown solvent: {x[isnan(rows).argmax()]}')
+        return DataFrame(self.__table[rows.astype(int)], columns=self.__header)
+
+    def __mixture(self, x):
+        """
+        Descriptors of solvents mixtures. Descriptors of solvents averaged with amounts as weights.
+
+        :param x: ConditionsBatch or sequence of Conditions or of lists of (solvent, amount) pairs
+        """
+        if not isinstance(x, ConditionsBatch):
+            if hasattr(x, 'columns'):  # DataFrame of Conditions
+                if x.shape[1] != 1:
+                    raise ValueError('invalid data shape')
+                x = x.iloc[:, 0]
+            x = ConditionsBatch.from_conditions(c if isinstance(c, Conditions) else Conditions(solvents=c) for c in x)
+        if not len(x):
+            raise ValueError('empty input array')
+
+        rows = _code_rows[x.solvents]
+        if (rows[x.solvents != -1] == -1).any():
+            raise KeyError('solvent without descriptors in mixture')
+        total = x.amounts.sum(axis=1)
+        if not total.all():
+            raise ValueError('conditions without solvents')
+
+        mask = x.solvents != -1
+        weights = zeros((len(x), len(_descriptors)))
+        add.at(weights, (mask.nonzero()[0], rows[mask]), x.amounts[mask])
+        weights /= total[:, None]
+        return DataFrame(weights @ self.__table, columns=self.__header)
 
     _dtype = str
+    mixture = False
 
 
 described_solvents = dict((
@@ -212,4 +255,13 @@ described_solvents = dict((
         ('trichloromethane', (.265, .209, .565, .796, .361, .66, .076, .2, .1, .58, .79, .07, .05)),
         ('water', (.205, .17, .963, .987, .49, .975, .084, 1.17, .47, 1.09, .96, .03, 1.06))))
 
+_descriptors = array(list(described_solvents.values()))
+_index = {k: i for i, k in enumerate(described_solvents)}
+_index.update((hyphens_replace(k), i) for i, k in enumerate(described_solvents))
+_code_rows = zeros(len(solvent_codes) + 1, dtype=int)  # last for empty places
+for _n, _c in solvent_codes.items():
+    _code_rows[_c] = _index.get(_n, -1)
+_code_rows[-1] = -1
+
+
 __all__ = ['SolventVectorizer']
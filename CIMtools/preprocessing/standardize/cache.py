@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2021 Ramil Nugmanov <nougmanoff@protonmail.com>
+#  This file is part of CIMtools.
+#
+#  CIMtools is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from CGRtools.containers import ReactionContainer
+from hashlib import sha256
+from pathlib import Path
+from pickle import dumps, loads
+from time import time_ns
+from ...utils import SQLiteLRU
+
+
+class MappingCache(SQLiteLRU):
+    def __init__(self, path, capacity=100000, namespace=b''):
+        """
+        Persistent LRU cache of reactions atom-to-atom mapping.
+
+        Reactions keyed by canonical signature of unmapped structure. Only atom numbers of molecules in
+        canonical order stored. Cached mapping applied to copy of given reaction, so molecules order, meta and
+        other attributes of given reaction kept. Cache can be shared between processes.
+
+        :param path: cache directory
+        :param capacity: maximal number of stored reactions
+        :param namespace: bytes mixed into keys. e.g. mapper name and parameters
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        super().__init__(path / 'atom_mapping.sqlite', 'mapping BLOB NOT NULL')
+        self.capacity = capacity
+        self.namespace = namespace
+
+    @staticmethod
+    def signature(reaction):
+        """
+        Canonical signature of reaction independent of atom mapping and order of molecules.
+        """
+        return '>'.join('.'.join(sorted(str(m) for m in ms))
+                        for ms in (reaction.reactants, reaction.reagents, reaction.products))
+
+    def key(self, reaction):
+        return sha256(self.namespace + self.signature(reaction).encode()).digest()
+
+    @staticmethod
+    def mapping(reaction):
+        """
+        Atom numbers of molecules of each role in canonical order.
+        """
+        return tuple(tuple(m.smiles_atoms_order for m in sorted(ms, key=str))
+                     for ms in (reaction.reactants, reaction.reagents, reaction.products))
+
+    @staticmethod
+    def apply(reaction, mapping):
+        """
+        Copy of reaction with atoms renumbered by cached mapping.
+        """
+        roles = []
+        for ms, numbers in zip((reaction.reactants, reaction.reagents, reaction.products), mapping):
+            slots = {}  # canonical position of molecule by structure. equal molecules take positions in order
+            for n, m in enumerate(sorted(ms, key=str)):
+                slots.setdefault(str(m), []).append(n)
+            roles.append([m.remap(dict(zip(m.smiles_atoms_order, numbers[slots[str(m)].pop(0)])), copy=True)
+                          for m in ms])
+        reactants, reagents, products = roles
+        return ReactionContainer(reactants, products, reagents, meta=reaction.meta.copy(), name=reaction.name)
+
+    def get(self, keys):
+        """
+        Get cached mappings.
+
+        :return: list of mappings. None for not found keys
+        """
+        with self._transaction() as db:
+            found = self._select(db, keys, 'mapping')
+        return [loads(found[k]) if k in found else None for k in keys]
+
+    def put(self, keys, mappings):
+        """
+        Store mappings. The least recently used mappings evicted if cache is full.
+        """
+        used = time_ns()
+        with self._transaction(lock=True) as db:
+            db.executemany('INSERT OR REPLACE INTO cache (key, mapping, used) VALUES (?, ?, ?)',
+                           ((k, dumps(m), used) for k, m in zip(keys, mappings)))
+            count, = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+            if count > self.capacity:
+                db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)',
+                           (count - self.capacity,))
+
+    def map(self, reactions, mapper):
+        """
+        Map reactions using cache. Only not cached reactions are mapped by mapper and stored.
+
+        :param reactions: list of reactions
+        :param mapper: callable taking list of reactions and returning list of mapped reactions.
+            reactions returned as is or with changed structure are treated as not mapped and not stored
+        """
+        keys = [self.key(r) for r in reactions]
+        mappings = self.get(keys)
+        missing = {}
+        for n, m in enumerate(mappings):
+            if m is None:
+                missing.setdefault(keys[n], []).append(n)
+
+        out = [None if m is None else self.apply(r, m) for r, m in zip(reactions, mappings)]
+        if missing:
+            sources = [reactions[i[0]] for i in missing.values()]
+            store = []
+            for (k, i), s, r in zip(missing.items(), sources, mapper(sources)):
+                out[i[0]] = r
+                if r is s or self.signature(r) != self.signature(s):  # not mapped
+                    for n in i[1:]:
+                        out[n] = reactions[n]
+                    continue
+                m = self.mapping(r)
+                for n in i[1:]:
+                    out[n] = self.apply(reactions[n], m)
+                store.append((k, m))
+            if store:
+                self.put(*zip(*store))
+        return out
+
+
+class MappingCacheMixin:
+    """
+    Mapping cache of transformers with cache and cache_size parameters.
+
+    Cache opened once per process and shared by transformers with same parameters and namespace.
+    """
+    @property
+    def cache_info(self):
+        """
+        Mapping cache hits, misses and hit rate. None if cache not used.
+        """
+        if self.cache:
+            cache = self._open_cache()
+            return {'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.hit_rate, 'size': len(cache)}
+
+    def _open_cache(self):
+        namespace = self._cache_namespace()
+        key = (self.cache, self.cache_size, namespace)
+        cache = self.__caches.get(key)
+        if cache is None:
+            self.__caches[key] = cache = MappingCache(self.cache, self.cache_size, namespace=namespace)
+        return cache
+
+    def _cache_namespace(self):
+        """
+        Bytes mixed into cache keys: mapper name and parameters.
+        """
+        raise NotImplementedError
+
+    __caches = {}
+
+
+__all__ = ['MappingCache', 'MappingCacheMixin']
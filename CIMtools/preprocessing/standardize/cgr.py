@@ -17,28 +17,46 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from CGRtools.containers import MoleculeContainer, ReactionContainer
-from pandas import DataFrame
 from ...base import CIMtoolsTransformerMixin
+from ...utils import chunked_map, effective_n_jobs, validated_frame
 
 
 class StandardizeCGR(CIMtoolsTransformerMixin):
-    def __init__(self):
+    def __init__(self, inplace=False, n_jobs=None, chunk_size=None):
         """
         Reactions and Molecules standardization
 
         For molecules kekule/thiele and groups standardization procedures will be applied.
+
+        :param inplace: standardize given structures without copying. use only if structures are not needed as is
+        :param n_jobs: number of worker processes. workers standardize own copies of structures, thus input
+            structures are not changed
+        :param chunk_size: number of structures sent to worker at once. by default structures evenly split
         """
+        self.inplace = inplace
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
 
     def transform(self, x):
-        return DataFrame([[self.__prepare(g)] for g in super().transform(x)], columns=['standardized'])
-
-    @staticmethod
-    def __prepare(r):
-        r = r.copy()
-        r.canonicalize()
-        return r
+        x = super().transform(x)
+        types = getattr(x, 'element_types', None)  # standardization keeps types
+        if effective_n_jobs(self.n_jobs) > 1:
+            x = [g for chunk in chunked_map(_canonicalize, x, self.n_jobs, self.chunk_size) for g in chunk]
+        elif self.inplace:
+            x = _canonicalize(x)
+        else:
+            x = _canonicalize([g.copy() for g in x])
+        return validated_frame(x, 'standardized', types)
 
     _dtype = (MoleculeContainer, ReactionContainer)
+    inplace = False
+    n_jobs = chunk_size = None
+
+
+def _canonicalize(structures):
+    for g in structures:
+        g.canonicalize()
+    return structures
 
 
 __all__ = ['StandardizeCGR']
@@ -18,121 +18,480 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
-from CGRtools import RDFRead, RDFWrite, ReactionContainer
+from CGRtools import MoleculeContainer, RDFRead, RDFWrite, ReactionContainer
+from collections import deque
 from io import StringIO
+from itertools import islice
 from logging import warning
-from pandas import DataFrame
+from multiprocessing import get_context
+from multiprocessing.connection import wait
 from pathlib import Path
-from queue import Empty, Queue
+from queue import Queue
 from shutil import which
-from threading import Thread
+from threading import Event, Lock, Thread
+from time import monotonic
+from .cache import MappingCacheMixin
 from ...base import CIMtoolsTransformerMixin
 from ...exceptions import ConfigurationError
+from ...utils import effective_n_jobs, iter2array, validated_frame
 
 
-class ExcThread(Thread):
-    def __init__(self, bucket, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.bucket = bucket
+class Task:
+    def __init__(self, molecule, timeout):
+        """
+        Standardization of single java molecule.
+
+        :param timeout: seconds given to standardization. counted from the start of processing by worker
+        """
+        self.molecule = molecule
+        self.timeout = timeout
+        self.deadline = self.error = self.worker = None
+        self.cancelled = False
+        self.lock = Lock()
+        self.done = Event()
+
+    def wait(self):
+        """
+        Wait for processing. On timeout task cancelled and worker interrupted.
+
+        :return: False on timeout
+        """
+        while not self.done.wait(.1 if self.deadline is None else max(self.deadline - monotonic(), 0)):
+            if self.deadline is not None and monotonic() >= self.deadline:
+                with self.lock:
+                    if self.done.is_set():
+                        return True
+                    self.cancelled = True
+                    if self.worker is not None:
+                        self.worker.java_thread.interrupt()
+                return False
+        return True
+
+
+class Worker(Thread):
+    def __init__(self, tasks, standardizer, java_thread):
+        """
+        Long-lived thread running java standardizer on tasks from shared queue.
+        """
+        super().__init__(daemon=True)
+        self.tasks = tasks
+        self.standardizer = standardizer
+        self.java_thread = None
+        self.retired = False  # stuck worker replaced by new one. should exit after current task
+        self.__java_thread = java_thread
 
     def run(self):
+        from jnius import detach
+
+        self.java_thread = self.__java_thread.currentThread()
+        try:
+            while not self.retired:
+                task = self.tasks.get()
+                if task is None:
+                    return
+                with task.lock:
+                    if task.cancelled:
+                        continue
+                    self.__java_thread.interrupted()  # clear interruption of previous task
+                    task.worker = self
+                    task.deadline = monotonic() + task.timeout
+                try:
+                    self.standardizer.standardize(task.molecule)
+                except Exception as e:
+                    task.error = e
+                with task.lock:
+                    task.worker = None
+                    task.done.set()
+        finally:
+            detach()
+
+
+class Shard:
+    def __init__(self, cls, state, heap):
+        """
+        Worker process with own JVM. Processes chunks of records sent by pipe.
+        """
+        self.__args = cls, state, heap
+        self.start()
+
+    def start(self):
+        conn, child = get_context('spawn').Pipe()
+        self.process = get_context('spawn').Process(target=_serve, args=(child, *self.__args), daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = conn
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def stop(self):
         try:
-            return super().run()
+            self.conn.send(None)
+        except OSError:  # worker crashed
+            pass
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+            if self.process.is_alive():  # JVM ignored SIGTERM
+                self.process.kill()
+                self.process.join()
+
+
+def _serve(conn, cls, state, heap):
+    standardizer = cls.__new__(cls, heap=heap)
+    standardizer.__setstate__(state)
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        chunk, timeout, start = task
+        try:
+            out = standardizer._standardize(chunk, timeout, start)
         except Exception as e:
-            self.bucket.put(e)
-            raise
+            try:
+                conn.send(('error', e))
+            except Exception:  # not picklable
+                conn.send(('error', ValueError(str(e))))
+        else:  # not processed records replaced by None. stuck java threads can be freed only by process restart
+            conn.send(('ok', [None if r is s else r for r, s in zip(out, chunk)], standardizer._stuck()))
 
 
 class StandardizeChemAxon(CIMtoolsTransformerMixin):
-    def __init__(self, rules, *, _skip_errors=False):
+    def __init__(self, rules, *, n_workers=1, batch_size=100, n_jobs=None, chunk_size=1000, heap='2048M',
+                 retries=2, _skip_errors=False):
+        """
+        ChemAxon Standardizer
+
+        :param rules: standardizer configuration xml
+        :param n_workers: number of long-lived threads running standardizer
+        :param batch_size: number of records imported to JVM at once
+        :param n_jobs: number of worker processes with own JVM. chunks of records processed in parallel.
+            worker processes are restarted if standardization hung, so use n_jobs > 1 for untrusted inputs
+        :param chunk_size: number of records sent to worker process at once
+        :param heap: maximal heap size of JVM, e.g. '4G'. applied on JVM start, i.e. for worker processes and
+            for current process only on first use
+        :param retries: number of worker process restarts for chunk crashed it
+        """
         self.rules = rules
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.heap = heap
+        self.retries = retries
         self.__skip = _skip_errors
-        self.__standardizer_obj = self.__standardizer(rules)
+        self.__init()
 
-    def __new__(cls, *args, **kwargs):
+    def __new__(cls, *args, heap='2048M', **kwargs):
         if cls.__standardizer is None:  # load only once
             from jnius_config import add_classpath, add_options
             add_classpath(*jars)
-            add_options('-Xms512M', '-Xmx2048M')
+            add_options('-Xms512M', f'-Xmx{heap}')
             from jnius import autoclass
 
             cls.__standardizer = autoclass('chemaxon.standardizer.Standardizer')
             cls.__importer = autoclass('chemaxon.formats.MolImporter')
             cls.__exporter = autoclass('chemaxon.formats.MolExporter')
+            cls.__input_stream = autoclass('java.io.ByteArrayInputStream')
+            cls.__java_thread = autoclass('java.lang.Thread')
         return super().__new__(cls)
 
+    def __init(self):
+        self.__standardizer_obj = self.__standardizer(self.rules)  # validate rules
+        self.__tasks = Queue()
+        self.__workers = []
+        self.__retired = []
+        self.__shards = []
+
     def __getstate__(self):
-        return {'rules': self.rules}
+        return {'rules': self.rules, 'n_workers': self.n_workers, 'batch_size': self.batch_size,
+                'n_jobs': self.n_jobs, 'chunk_size': self.chunk_size, 'heap': self.heap, 'retries': self.retries,
+                '_StandardizeChemAxon__skip': self.__skip}
 
     def __setstate__(self, state):
         super().__setstate__(state)
-        self.__standardizer_obj = self.__standardizer(self.rules)
+        self.__init()
 
     def set_params(self, **params):
         if params:
+            self.__stop()
             super().set_params(**params)
-            self.__standardizer_obj = self.__standardizer(self.rules)
+            self.__init()
         return self
 
+    def __del__(self):
+        try:
+            self.__stop()
+        except AttributeError:  # not initialized
+            pass
+
     def transform(self, x, *, timeout=10):
+        """
+        Standardize structures.
+
+        :param timeout: seconds given to standardization of each structure. timed out structures are skipped or
+            raise error. java code can't be stopped within JVM, thus in single process mode (n_jobs=1) timed out
+            standardization keeps running in background thread and its worker is replaced by new one.
+            Timeouts fully take effect only with n_jobs > 1, where worker processes with stuck threads restarted
+        """
         x = super().transform(x)
-        bucket = Queue()
+        types = getattr(x, 'element_types', None)  # molecules and reactions keep types after RDF round trip
+        if types is not None and not all(issubclass(t, (MoleculeContainer, ReactionContainer)) for t in types):
+            types = None
+        if effective_n_jobs(self.n_jobs) > 1:
+            out = self.__sharded(x, timeout)
+        else:
+            out = self._standardize(x, timeout)
+        return validated_frame(out, 'standardized', types)
+
+    def _standardize(self, x, timeout, start=0):
+        """
+        Standardize records in current process.
+
+        :param start: number of first record used in messages
+        """
+        x = iter(x)
+        self.__start()
         out = []
-        for n, s in enumerate(x):
-            with StringIO() as f:
-                with RDFWrite(f) as w:
+        n = start
+        for batch in iter(lambda: list(islice(x, self.batch_size)), []):
+            tasks = [None if m is None else Task(m, timeout) for m in self.__import(batch)]
+            for t in tasks:
+                if t is not None:
+                    self.__tasks.put(t)
+            for t in tasks:  # timeouts of batch checked before retries, which are queued after batch
+                if t is not None and not t.wait():
+                    self.__release(t)
+            for s, t in zip(batch, tasks):
+                if t is None or not t.cancelled and t.error is not None:  # retry failed record separately
+                    t = self.__retry(s, timeout)
+                out.append(self.__export(n, s, t))
+                n += 1
+        return out
+
+    def __start(self):
+        while len(self.__workers) < self.n_workers:
+            w = Worker(self.__tasks, self.__standardizer(self.rules), self.__java_thread)
+            w.start()
+            self.__workers.append(w)
+
+    def __stop(self):
+        for _ in self.__workers:
+            self.__tasks.put(None)
+        self.__workers = []
+        self.__stop_shards()
+
+    def __release(self, task):
+        """
+        Replace worker which ignored interruption of cancelled task.
+        """
+        if task.done.wait(self._grace):
+            return
+        with task.lock:
+            worker = task.worker
+            if worker is None:
+                return
+            worker.retired = True
+        self.__workers.remove(worker)
+        self.__retired.append(worker)
+        self.__start()
+
+    def _stuck(self):
+        """
+        Check for replaced workers still running cancelled tasks.
+        """
+        self.__retired = [w for w in self.__retired if w.is_alive()]
+        return bool(self.__retired)
+
+    def __sharded(self, x, timeout):
+        """
+        Process chunks of records in worker processes. Crashed workers restarted and their chunks retried.
+        """
+        shards = self.__shards
+        if len(shards) < effective_n_jobs(self.n_jobs):
+            state = self.__getstate__()
+            state['n_jobs'] = None
+            while len(shards) < effective_n_jobs(self.n_jobs):
+                shards.append(Shard(type(self), state, self.heap))
+
+        x = iter(x)
+        chunks = enumerate(iter(lambda: list(islice(x, self.chunk_size)), []))
+        retry = deque()
+        busy = {}  # shard: (chunk number, chunk, crashes)
+        results = {}
+        try:
+            while True:
+                for shard in shards:
+                    if shard in busy:
+                        continue
+                    if retry:
+                        task = retry.popleft()
+                    else:
+                        task = next(chunks, None)
+                        if task is None:
+                            break
+                        task = (*task, 0)
+                    shard.conn.send((task[1], timeout, task[0] * self.chunk_size))
+                    # each record can time out and replace stuck java thread
+                    deadline = monotonic() + len(task[1]) * (timeout + self._grace) + self._startup
+                    busy[shard] = (*task, deadline)
+                if not busy:
+                    break
+
+                ready = wait([s.conn for s in busy] + [s.process.sentinel for s in busy],
+                             max(min(x[-1] for x in busy.values()) - monotonic(), 0))
+                for shard, (n, chunk, crashes, deadline) in list(busy.items()):
+                    if shard.conn in ready or shard.conn.poll():
+                        try:
+                            status, out, *stuck = shard.conn.recv()
+                        except EOFError:
+                            pass
+                        else:
+                            del busy[shard]
+                            if status == 'error':
+                                raise out
+                            results[n] = [s if r is None else r for r, s in zip(out, chunk)]
+                            if stuck[0]:  # free java threads ignored interruption
+                                shard.restart()
+                            continue
+                    elif shard.process.sentinel not in ready and monotonic() < deadline:
+                        continue
+                    # worker crashed or hung
+                    del busy[shard]
+                    shard.restart()
+                    if crashes >= self.retries:
+                        raise RuntimeError(f'chunk {n} crashed or hung worker {crashes + 1} times')
+                    retry.append((n, chunk, crashes + 1))
+        except BaseException:
+            self.__stop_shards()  # drop unfinished chunks
+            raise
+        return [s for n in range(len(results)) for s in results[n]]
+
+    def __stop_shards(self):
+        for shard in self.__shards:
+            shard.stop()
+        self.__shards = []
+
+    def __import(self, batch):
+        """
+        Import batch of records in one stream. If records can't be matched with structures, Nones returned.
+        """
+        with StringIO() as f:
+            with RDFWrite(f) as w:
+                for s in batch:
                     w.write(s)
-                js = self.__importer.importMol(f.getvalue(), 'rdf')
+            data = f.getvalue().encode()
+        try:
+            importer = self.__importer(self.__input_stream(data), 'rdf')
+            try:
+                molecules = list(iter(importer.read, None))
+            finally:
+                importer.close()
+        except Exception:
+            molecules = []
+        if len(molecules) != len(batch):
+            return [None] * len(batch)
+        return molecules
 
+    def __retry(self, s, timeout):
+        with StringIO() as f:
+            with RDFWrite(f) as w:
+                w.write(s)
             try:
-                thread = ExcThread(bucket, target=self.__standardizer_obj.standardize, args=(js, ), daemon=True)
-                thread.start()
-                thread.join(timeout)
+                js = self.__importer.importMol(f.getvalue(), 'rdf')
             except Exception as e:
-                if 'Invalid standardizer action' in e.args[0]:
-                    raise ConfigurationError from e
-                if self.__skip:
-                    warning(f'structure ({n}): {s} not processed')
-                    out.append([s])
-                    continue
-                raise ValueError from e
-            else:
-                try:
-                    e = bucket.get(block=False)
-                except Empty:
-                    pass
-                else:
-                    if self.__skip:
-                        warning(f'structure ({n}): {s} not processed due to: {e.args[0]}')
-                        out.append([s])
-                        continue
-                    raise ValueError from e
+                js = e
+        if isinstance(js, Exception):
+            task = Task(None, timeout)
+            task.error = js
+            task.done.set()
+        else:
+            task = Task(js, timeout)
+            self.__tasks.put(task)
+            if not task.wait():
+                self.__release(task)
+        return task
 
-            rdf = self.__exporter.exportToFormat(js, 'rdf')
+    def __export(self, n, s, task):
+        if task.cancelled:
+            reason = 'timeout'
+        elif task.error is not None:
+            e = task.error
+            if e.args and isinstance(e.args[0], str) and 'Invalid standardizer action' in e.args[0]:
+                raise ConfigurationError from e
+            if not self.__skip:
+                raise ValueError(f'structure ({n}): {s} not processed') from e
+            reason = e.args and e.args[0]
+        else:
+            rdf = self.__exporter.exportToFormat(task.molecule, 'rdf')
             with StringIO(rdf) as f, RDFRead(f, remap=False) as r:
                 p = r.read()
-                if not p:
-                    if self.__skip:
-                        warning(f'structure ({n}): {s} export failed')
-                        out.append([s])
-                        continue
-                    raise ValueError(f'structure ({n}): {s} export failed')
-            out.append(p)
-        return DataFrame(out, columns=['standardized'])
+            if p:
+                return p[0]
+            reason = 'export failed'
+
+        if self.__skip:
+            warning(f'structure ({n}): {s} not processed due to: {reason}')
+            return s
+        raise ValueError(f'structure ({n}): {s} not processed due to: {reason}')
 
     __standardizer = None
     __importer = None
     __exporter = None
+    __input_stream = None
+    __java_thread = None
+    _grace = 5  # seconds given to interrupted worker before replacement
+    _startup = 120  # seconds given to worker process for JVM start
+    n_workers = 1
+    batch_size = 100
+    n_jobs = None
+    chunk_size = 1000
+    heap = '2048M'
+    retries = 2
+
+
+class MappingChemAxon(MappingCacheMixin, StandardizeChemAxon):
+    def __init__(self, *, n_workers=1, batch_size=100, n_jobs=None, chunk_size=1000, heap='2048M', retries=2,
+                 cache=None, cache_size=100000, _skip_errors=False):
+        """
+        ChemAxon reactions mapper
 
+        :param cache: path to directory of persistent mapping cache. only not cached reactions will be mapped.
+            not mapped due to errors reactions are not cached
+        :param cache_size: maximal number of cached reactions. the least recently used are evicted
 
-class MappingChemAxon(StandardizeChemAxon):
-    def __init__(self, *, _skip_errors=False):
+        Other parameters same as for StandardizeChemAxon.
+        """
+        self.cache = cache
+        self.cache_size = cache_size
         rules = '<?xml version="1.0" encoding="UTF-8"?><StandardizerConfiguration Version="0.1"><Actions>' \
                 '<UnmapReaction ID="Unmap"/><MapReaction ID="Map Reaction" KeepMapping="false" ' \
                 'MappingStyle="COMPLETE" MarkBonds="false"/></Actions></StandardizerConfiguration>'
-        super().__init__(rules, _skip_errors=_skip_errors)
+        super().__init__(rules, n_workers=n_workers, batch_size=batch_size, n_jobs=n_jobs, chunk_size=chunk_size,
+                         heap=heap, retries=retries, _skip_errors=_skip_errors)
+
+    def __getstate__(self):
+        return {**super().__getstate__(), 'cache': self.cache, 'cache_size': self.cache_size}
+
+    def transform(self, x, *, timeout=10):
+        if not self.cache:
+            return super().transform(x, timeout=timeout)
+
+        def mapper(reactions):
+            return super(MappingChemAxon, self).transform(reactions, timeout=timeout)['standardized'].tolist()
+
+        out = self._open_cache().map(list(iter2array(x, dtype=self._dtype)), mapper)
+        return validated_frame(out, 'standardized', (ReactionContainer,))
+
+    def _cache_namespace(self):
+        return b'ChemAxon:' + self.rules.encode()
 
     _dtype = ReactionContainer
+    cache = None
+    cache_size = 100000
 
 
 std = which('standardize')
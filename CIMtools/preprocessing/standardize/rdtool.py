@@ -19,50 +19,238 @@
 #
 from CGRtools.containers import ReactionContainer
 from CGRtools import RDFRead, RDFWrite
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import sha256
+from multiprocessing import get_context
 from os import name
 from os.path import devnull
-from pandas import DataFrame
 from pathlib import Path
+from queue import Queue
 from shutil import rmtree
 from subprocess import call
 from sys import prefix, exec_prefix
 from tempfile import mkdtemp
 from warnings import warn
+from zipfile import ZipFile
+from .cache import MappingCacheMixin
 from ...base import CIMtoolsTransformerMixin
 from ...exceptions import ConfigurationError
+from ...utils import effective_n_jobs, validated_frame
 
 
-class RDTool(CIMtoolsTransformerMixin):
-    def __init__(self, algorithm='max', verbose=False):
+class RDToolWorker:
+    def __init__(self, verbose=False):
+        """
+        Process with warm JVM running RDTool main class on arguments sent by pipe.
+        """
+        self.verbose = verbose
+        self.start()
+
+    def start(self):
+        context = get_context('spawn')
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, str(jar_path), self.verbose), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:  # worker exited
+            pass
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    def run(self, args):
+        """
+        Run RDTool main.
+
+        :return: False if JVM exited. Worker restarted, results check is up to caller
+        """
+        try:
+            self.conn.send(args)
+            status, message = self.conn.recv()
+        except (EOFError, OSError):
+            self.stop()
+            self.start()
+            return False
+        if status == 'error':
+            raise ConfigurationError(message)
+        return True
+
+
+def _serve(conn, jar, verbose):
+    from jnius_config import add_classpath
+    add_classpath(jar)
+    from jnius import autoclass
+
+    with ZipFile(jar) as z:
+        manifest = z.read('META-INF/MANIFEST.MF').decode()
+    main = next(x.split(':', 1)[1].strip() for x in manifest.splitlines() if x.startswith('Main-Class:'))
+    tool = autoclass(main)
+    if not verbose:
+        system = autoclass('java.lang.System')
+        silent = autoclass('java.io.PrintStream')(autoclass('java.io.FileOutputStream')(devnull))
+        system.setOut(silent)
+        system.setErr(silent)
+
+    while True:
+        args = conn.recv()
+        if args is None:
+            return
+        try:
+            tool.main(args)
+        except Exception as e:
+            conn.send(('error', str(e)))
+        else:
+            conn.send(('ok', None))
+
+
+class RDTool(MappingCacheMixin, CIMtoolsTransformerMixin):
+    def __init__(self, algorithm='max', verbose=False, n_jobs=None, chunk_size=None, persistent=False, cache=None,
+                 cache_size=100000):
         """
         :param algorithm: 'max','min','mixture'
+        :param n_jobs: number of chunks mapped in parallel
+        :param chunk_size: number of reactions in chunk. by default reactions evenly split between jobs
+        :param persistent: map chunks by long-lived processes with warm JVM instead of JVM launch per chunk.
+            processes kept until transformer deleted. if RDTool main exits JVM on every call, JVM launch per chunk
+            used instead
+        :param cache: path to directory of persistent mapping cache. only not cached reactions will be mapped
+        :param cache_size: maximal number of cached reactions. the least recently used are evicted
         """
         self.algorithm = algorithm
         self.verbose = verbose
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.persistent = persistent
+        self.cache = cache
+        self.cache_size = cache_size
+        self.__init()
+
+    def __init(self):
+        self.__workers = Queue()
+        self.__exits = 0
+        self.__fallback = False
+
+    def __getstate__(self):
+        return {k: v for k, v in super().__getstate__().items() if not k.startswith('_RDTool__')}
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.__init()
+
+    def __del__(self):
+        try:
+            self.__stop()
+        except AttributeError:  # not initialized
+            pass
+
+    def __stop(self):
+        workers = self.__workers
+        while not workers.empty():
+            workers.get().stop()
 
     def transform(self, x):
         x = super().transform(x)
 
-        algorithms = ['max', 'min', 'mixture']
-        if self.algorithm not in algorithms:
+        if self.algorithm not in ('max', 'min', 'mixture'):
             raise ValueError("Invalid value for algorithm of mapping. Allowed string values are 'max','min','mixture'")
-        algorithms.remove(self.algorithm)
 
+        if self.cache:
+            out = self._open_cache().map(list(x), self.__transform)
+        else:
+            out = self.__transform(x)
+        return validated_frame(out, 'reaction', (ReactionContainer,))
+
+    def _cache_namespace(self):
+        return b'RDTool:' + self.algorithm.encode() + _jar_hash()
+
+    def __transform(self, x):
+        n_jobs = effective_n_jobs(self.n_jobs)
+        chunk_size = self.chunk_size or max(-(-len(x) // n_jobs), 1)
+        x = list(x)
+        chunks = [x[i: i + chunk_size] for i in range(0, len(x), chunk_size)]
+        if self.__fallback:
+            self.__stop()
+        elif self.persistent:
+            for _ in range(min(n_jobs, len(chunks)) - self.__workers.qsize()):
+                self.__workers.put(RDToolWorker(self.verbose))
+
+        if n_jobs == 1 or len(chunks) == 1:
+            out = [self.__map(c) for c in chunks]
+        else:
+            with ThreadPoolExecutor(n_jobs) as executor:
+                out = list(executor.map(self.__map, chunks))
+        return [r for c in out for r in c]
+
+    def __map(self, x):
         work_dir = Path(mkdtemp(prefix='rdt_'))
         input_file = work_dir / 're_map.rdf'
         out_folder = work_dir / 'results'
+        try:
+            with RDFWrite(input_file) as f:
+                for num, r in enumerate(x):
+                    meta = r.meta.copy()
+                    r.meta.clear()
+                    r.meta['Id'] = num
+                    f.write(r)
+                    r.meta.clear()
+                    r.meta.update(meta)
+
+            out_file = out_folder / (self.algorithm.upper() + '_reactions.rdf')
+            legacy = RDTool.__legacy_flags
+            try:
+                self.__run(input_file, out_folder, legacy)
+                if not out_file.exists():
+                    raise ConfigurationError('execution failed')
+            except ConfigurationError:
+                if legacy:
+                    raise
+                # older jar builds expect flags of not used algorithms
+                rmtree(out_folder, ignore_errors=True)
+                self.__run(input_file, out_folder, True)
+                if not out_file.exists():
+                    raise
+                RDTool.__legacy_flags = True
+            with RDFRead(out_file) as f:
+                x_out = f.read()
+            if len(x) != len(x_out):
+                raise ValueError('invalid data')
+            return x_out
+        finally:
+            rmtree(work_dir)
+
+    def __run(self, input_file, out_folder, legacy):
+        params = ['-j', 'MAPPING', '-i', str(input_file), '-o', str(out_folder), '-rdf_id', 'Id']
+        if legacy:
+            params.extend('-' + x for x in ('max', 'min', 'mixture') if x != self.algorithm)
+        else:  # run only required algorithm
+            params.append('-' + self.algorithm)
+
+        if not self.persistent or self.__fallback:
+            return self.__call(params)
+
+        worker = self.__workers.get()
+        try:
+            alive = worker.run(params)
+        finally:
+            self.__workers.put(worker)
+        if alive:
+            self.__exits = 0
+        else:
+            self.__exits += 1
+            if self.__exits >= 2 and not self.__fallback:
+                self.__fallback = True
+                warn('RDTool main exits JVM on every call. persistent workers replaced by JVM launch per chunk',
+                     RuntimeWarning)
 
-        with RDFWrite(input_file) as f:
-            for num, r in enumerate(x):
-                meta = r.meta.copy()
-                r.meta.clear()
-                r.meta['Id'] = num
-                f.write(r)
-                r.meta.clear()
-                r.meta.update(meta)
-
-        execparams = ['java', '-jar', jar_path, '-j', 'MAPPING', '-i', input_file, '-o', out_folder, '-rdf_id', 'Id',
-                      '-' + algorithms[0], '-' + algorithms[1]]
+    def __call(self, params):
+        execparams = ['java', '-jar', jar_path, *params]
         try:
             if self.verbose:
                 exitcode = call(execparams) != 0
@@ -70,23 +258,22 @@ class RDTool(CIMtoolsTransformerMixin):
                 with open(devnull, 'w') as silent:
                     exitcode = call(execparams, stdout=silent, stderr=silent) != 0
         except FileNotFoundError as e:
-            rmtree(work_dir)
             raise ConfigurationError(e)
 
         if exitcode:
-            rmtree(work_dir)
             raise ConfigurationError('execution failed')
 
-        out_file = self.algorithm.upper() + '_reactions.rdf'
-        x_out = RDFRead(Path(out_folder / out_file)).read()
-        if len(x) != len(x_out):
-            rmtree(work_dir)
-            raise ValueError('invalid data')
+    _dtype = ReactionContainer
+    __legacy_flags = False
+    n_jobs = chunk_size = cache = None
+    persistent = False
+    cache_size = 100000
 
-        rmtree(work_dir)
-        return DataFrame([[x] for x in x_out], columns=['reaction'])
 
-    _dtype = ReactionContainer
+@lru_cache()
+def _jar_hash():
+    with open(jar_path, 'rb') as f:
+        return sha256(f.read()).digest()
 
 
 def getsitepackages():
@@ -17,12 +17,78 @@
 #  along with this program; if not, see <https://www.gnu.org/licenses/>.
 #
 from CGRtools.containers import ReactionContainer, MoleculeContainer, CGRContainer
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
+from multiprocessing import get_context
 from numbers import Number
-from numpy import ndarray, ravel
+from os import cpu_count
+from sqlite3 import connect
+from time import time_ns
+from weakref import ref
+from numpy import fromiter, ndarray, ravel
 from pandas import DataFrame, Series
 
 
+class ValidatedSeries(Series):
+    """
+    Series of already validated data. Keeps types of elements, so repeated iter2array calls skip validation.
+
+    Derived objects are plain Series and validated again. Don't modify validated series inplace.
+    """
+    _metadata = ['element_types']
+
+    @property
+    def _constructor(self):
+        return Series
+
+
+@contextmanager
+def skip_validation():
+    """
+    Context manager disabling validation of elements types in iter2array. Useful for trusted inputs.
+    """
+    token = _validation.set(False)
+    try:
+        yield
+    finally:
+        _validation.reset(token)
+
+
+def validated_frame(data, column, types=None):
+    """
+    Single column DataFrame of transformer output.
+
+    If types of elements given, frame is backed by read-only array and types are bound to this array.
+    iter2array skips validation of frames and their slices sharing this array, e.g. in next pipeline step.
+    Derived frames with new data are validated again.
+    """
+    values = fromiter(data, dtype=object, count=len(data))
+    if types is not None:
+        values.flags.writeable = False
+        _validated[id(values)] = (ref(values, lambda _, key=id(values): _validated.pop(key, None)),
+                                  frozenset(types))
+    return DataFrame(values[:, None], columns=[column], dtype=object, copy=False)
+
+
+def _validated_types(data):
+    """
+    Types of elements of array sharing read-only data of validated frame.
+    """
+    owner = data
+    while isinstance(owner.base, ndarray):
+        owner = owner.base
+    try:
+        values, types = _validated[id(owner)]
+    except KeyError:
+        return
+    if values() is owner and not owner.flags.writeable:
+        return types
+
+
 def iter2array(data, dtype=(MoleculeContainer, ReactionContainer, CGRContainer)):
+    tagged = None
     if isinstance(data, ndarray):
         if len(data.shape) != 1:
             if len(data.shape) == 2 and data.shape[1] == 1:
@@ -33,12 +99,23 @@ def iter2array(data, dtype=(MoleculeContainer, ReactionContainer, CGRContainer))
         if data.shape[1] != 1:
             raise ValueError('invalid data shape')
         data = ravel(data)
+        tagged = _validated_types(data)
     elif not isinstance(data, (Series, list, tuple)):  # try to unpack iterable
         data = list(data)
 
     if not len(data):
         raise ValueError('empty input array')
-    if not all(isinstance(x, dtype) for x in data):
+    if tagged is not None:
+        types = tagged
+    elif isinstance(data, ValidatedSeries):
+        types = data.element_types
+    elif isinstance(data, (ndarray, Series)) and data.dtype.kind in 'biufc':  # numeric arrays of same type items
+        types = {type(next(iter(data)))}
+    elif _validation.get():
+        types = set(map(type, data))
+    else:
+        types = None
+    if types is not None and not all(issubclass(x, dtype) for x in types):
         raise TypeError('invalid dtype')
 
     if isinstance(data, (ndarray, Series)):
@@ -49,7 +126,11 @@ def iter2array(data, dtype=(MoleculeContainer, ReactionContainer, CGRContainer))
     if not issubclass(dtype, Number):
         dtype = object
 
-    return Series(data, dtype=dtype)
+    if types is None:
+        return Series(data, dtype=dtype)
+    data = ValidatedSeries(data, dtype=dtype)
+    data.element_types = frozenset(types)
+    return data
 
 
 def nested_iter_to_2d_array(data, dtype=(MoleculeContainer, ReactionContainer, CGRContainer)):
@@ -90,4 +171,115 @@ def nested_iter_to_2d_array(data, dtype=(MoleculeContainer, ReactionContainer, C
     return DataFrame(data, dtype=dtype)
 
 
-__all__ = ['iter2array', 'nested_iter_to_2d_array']
+class SQLiteLRU:
+    def __init__(self, file, value):
+        """
+        Base of persistent LRU caches with sqlite index. Index can be shared between processes.
+
+        :param file: sqlite database file
+        :param value: declaration of value column
+        """
+        self.hits = self.misses = 0
+        self._db = db = connect(str(file), timeout=60, isolation_level=None)
+        db.execute(f'CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, {value}, used INTEGER)')
+        db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+
+    @contextmanager
+    def _transaction(self, lock=False):
+        """
+        :param lock: lock index for writing
+        """
+        db = self._db
+        db.execute('BEGIN IMMEDIATE' if lock else 'BEGIN')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _select(self, db, keys, column):
+        """
+        Values of found keys. Last usage time of found keys updated. Hits and misses counted.
+        """
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i: i + 500]
+            found.update(db.execute(f'SELECT key, {column} FROM cache WHERE key IN ({",".join("?" * len(chunk))})',
+                                    chunk))
+        if found:
+            used = time_ns()
+            db.executemany('UPDATE cache SET used = ? WHERE key = ?', ((used, k) for k in found))
+        hits = sum(k in found for k in keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    @staticmethod
+    def _stored(db, keys):
+        """
+        Set of stored keys.
+        """
+        stored = set()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i: i + 500]
+            stored.update(k for k, in db.execute(f'SELECT key FROM cache WHERE key IN ({",".join("?" * len(chunk))})',
+                                                 chunk))
+        return stored
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+_validation = ContextVar('validation', default=True)
+_validated = {}
+
+
+def effective_n_jobs(n_jobs=None):
+    """
+    Number of processes for given n_jobs parameter.
+
+    None means 1. Negative values counted from cpu count: -1 means all cpu, -2 all cpu but one.
+    """
+    if n_jobs is None:
+        return 1
+    elif n_jobs < 0:
+        return max(cpu_count() + 1 + n_jobs, 1)
+    elif n_jobs == 0:
+        raise ValueError('n_jobs == 0 has no meaning')
+    return n_jobs
+
+
+def chunked_map(function, data, n_jobs=None, chunk_size=None, initializer=None, initargs=(), mp_context=None):
+    """
+    Apply function to chunks of data in pool of processes.
+
+    :param function: picklable callable. takes list of data items
+    :param data: sized iterable of items
+    :param n_jobs: number of processes
+    :param chunk_size: number of items in chunk. by default data evenly split between processes
+    :param initializer: callable run once in each worker process
+    :param mp_context: multiprocessing context or start method name. by default platform default used
+    :return: list of function results in order of chunks
+    """
+    n_jobs = effective_n_jobs(n_jobs)
+    if not chunk_size:
+        chunk_size = max(-(-len(data) // n_jobs), 1)
+    if isinstance(mp_context, str):
+        mp_context = get_context(mp_context)
+    data = iter(data)
+    with ProcessPoolExecutor(n_jobs, mp_context=mp_context, initializer=initializer, initargs=initargs) as executor:
+        return list(executor.map(function, iter(lambda: list(islice(data, chunk_size)), [])))
+
+
+__all__ = ['iter2array', 'nested_iter_to_2d_array', 'chunked_map', 'effective_n_jobs', 'skip_validation',
+           'ValidatedSeries', 'validated_frame', 'SQLiteLRU']
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of CIMtools.
+#
+#  CIMtools is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Throughput and peak memory of StandardizeCGR modes on synthetic mapped reactions.
+
+Each mode runs in a fresh interpreter, so peak RSS of modes is not mixed. Default copying mode is the baseline.
+Unix only (resource module). Usage:
+
+    python benchmarks/standardize_cgr.py [--size 3000] [--n-jobs 4] [--chunk-size 1000]
+"""
+from argparse import SUPPRESS, ArgumentParser
+from gc import collect
+from resource import RUSAGE_SELF, getrusage
+from subprocess import run
+from sys import argv, executable, platform
+from time import perf_counter
+
+
+reactions = ['[CH3:1][OH:2].[CH3:3][C:4](=[O:5])[OH:6]>>[CH3:3][C:4](=[O:5])[O:2][CH3:1].[OH2:6]',
+             'C1=CC=CC=C1N(=O)=O.[CH2:1]=[CH:2][CH:3]=[CH2:4].[CH2:5]=[CH2:6]>>'
+             '[CH2:1]1[CH:2]=[CH:3][CH2:4][CH2:5][CH2:6]1',
+             'c1ccccc1[Cl:1].[OH-:3]>>[Cl-:1].c1ccccc1[OH:3]']
+
+
+def modes(n_jobs, chunk_size):
+    return {'copy (baseline)': {},
+            'inplace': {'inplace': True},
+            f'n_jobs={n_jobs}': {'n_jobs': n_jobs},
+            f'n_jobs={n_jobs}, chunk_size={chunk_size}': {'n_jobs': n_jobs, 'chunk_size': chunk_size}}
+
+
+def peak_rss():
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return rss if platform == 'darwin' else rss * 1024  # bytes on macOS, KiB on Linux
+
+
+def measure(mode, size, n_jobs, chunk_size):
+    from CGRtools import smiles
+    from CIMtools.preprocessing import StandardizeCGR
+
+    data = [smiles(reactions[i % len(reactions)]) for i in range(size)]
+    collect()
+    before = peak_rss()
+    start = perf_counter()
+    StandardizeCGR(**modes(n_jobs, chunk_size)[mode]).transform(data)
+    elapsed = perf_counter() - start
+    print(f'{mode:<32} {size / elapsed:>8.0f} reactions/s {(peak_rss() - before) / 2 ** 20:>11.0f} MiB')
+
+
+def main():
+    parser = ArgumentParser(description='StandardizeCGR benchmark')
+    parser.add_argument('--size', type=int, default=3000, help='number of reactions')
+    parser.add_argument('--n-jobs', type=int, default=4, help='worker processes of parallel modes')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='chunk size of parallel mode')
+    parser.add_argument('--mode', help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        measure(args.mode, args.size, args.n_jobs, args.chunk_size)
+        return
+    print(f'{"mode":<32} {"throughput":>21} {"peak RSS growth":>15}', flush=True)
+    for mode in modes(args.n_jobs, args.chunk_size):
+        run([executable, argv[0], '--size', str(args.size), '--n-jobs', str(args.n_jobs),
+             '--chunk-size', str(args.chunk_size), '--mode', mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
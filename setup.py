@@ -64,7 +64,7 @@ setup(
     cmdclass=cmd_class,
     install_requires=['CGRtools>=4.0,<4.2', 'pandas>=0.22', 'scikit-learn>=0.24',
                       'pyparsing>=2.2', 'pyjnius>=1.3.0', 'StructureFingerprint'],
-    extras_require={'gnnfp': ['tensorflow>=2.2.0']},
+    extras_require={'gnnfp': ['tensorflow>=2.2.0'], 'gnnfp-numpy': ['h5py']},
     package_data={'CIMtools.preprocessing.graph_encoder': ['weights.h5'],
                   'CIMtools.datasets': ['data/*.rdf', 'data/tautomer_database_release_3a.xlsx']},
     data_files=[('lib', ['RDtool/rdtool.jar'])],
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of CIMtools.
+#
+#  CIMtools is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <https://www.gnu.org/licenses/>.
+#
+from CGRtools import smiles
+from numpy import abs as np_abs
+from pytest import importorskip, mark
+from CIMtools.preprocessing.graph_encoder import GNNFingerprint
+
+
+importorskip('tensorflow')
+importorskip('h5py')
+
+molecules = {'neutral': ['CCO', 'c1ccccc1C(=O)O', 'CC(C)(C)c1ccc(O)cc1N'],
+             'charged': ['C[N+](C)(C)C', 'CC(=O)[O-]', 'c1cc[n+](C)cc1.[Cl-]'],
+             'radical': ['[CH2]CC', 'C[O]', 'CC[CH]C(C)C'],
+             'small': ['O', 'CO', 'C=O', '[Na+]']}
+
+
+@mark.parametrize('batch_size', [None, 2])
+@mark.parametrize('kind', list(molecules))
+def test_numpy_engine_parity(kind, batch_size):
+    x = [smiles(s) for s in molecules[kind]]
+    for m in x:
+        m.canonicalize()
+    expected = GNNFingerprint(batch_size=batch_size, engine='tensorflow').transform(x)
+    result = GNNFingerprint(batch_size=batch_size, engine='numpy').transform(x)
+    assert result.shape == expected.shape
+    assert np_abs(result - expected).max() < 1e-5